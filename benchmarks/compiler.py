@@ -0,0 +1,53 @@
+from contextvars import copy_context
+from timeit import repeat
+from types import SimpleNamespace
+
+from vivi.compiler import compiled
+from vivi.elements import component, h
+from vivi.hooks import CONTEXT
+from vivi.paths import Paths
+
+
+def page(count):
+    return h.div({'class': 'page'})(
+        h.header(h.h1('Title'), h.nav(h.a(href='/')('Home'))),
+        h.main(
+            h.p('Lorem ipsum ', h.b('dolor'), ' sit amet.'),
+            h.table(
+                h.tr(h.th('Name'), h.th('Value'), h.th('Unit')),
+                h.tr(h.td('Count'), h.td(count), h.td('pcs')),
+                h.tr(h.td('Double'), h.td(count * 2), h.td('pcs')),
+            ),
+            h.p('Consectetur ', h.i('adipiscing'), ' elit.'),
+        ),
+        h.footer(h.small('Footer')),
+    )
+
+
+plain = component(page)
+fast = component(compiled(page))
+
+
+def rerender(elem, renders):
+    def run():
+        CONTEXT.set(SimpleNamespace(
+            path=[],
+            rerender_paths=Paths(),
+            static=True,
+            deadline=None,
+        ))
+        state, result = elem(count=0)._init()
+        for count in range(renders):
+            state, result = elem(count=count)._render(state, result)
+
+    copy_context().run(run)
+
+
+def bench(name, func, number):
+    best = min(repeat(func, number=number, repeat=5)) / number
+    print(f'{name}: {best * 1000:.3f}ms per 100 renders')
+
+
+if __name__ == '__main__':
+    bench('plain', lambda: rerender(plain, 100), 10)
+    bench('compiled', lambda: rerender(fast, 100), 10)
@@ -0,0 +1,47 @@
+from contextvars import copy_context
+from timeit import repeat
+from types import SimpleNamespace
+
+from vivi.elements import h
+from vivi.hooks import CONTEXT
+from vivi.paths import Paths
+
+
+ROWS = 1000
+
+
+def construct():
+    return h.table(
+        h.tbody([
+            h.tr({'class': 'row'}, key=i)(
+                h.td(str(i)),
+                h.td(h.a(href=f'/rows/{i}')('Row ', i)),
+            )
+            for i in range(ROWS)
+        ]),
+    )
+
+
+def render(elem):
+    def run():
+        CONTEXT.set(SimpleNamespace(
+            path=[],
+            rerender_paths=Paths(),
+            static=True,
+            deadline=None,
+        ))
+        state, result = elem._init()
+        return elem._render(state, result)
+
+    return copy_context().run(run)
+
+
+def bench(name, func, number):
+    best = min(repeat(func, number=number, repeat=5)) / number
+    print(f'{name}: {best * 1000:.3f}ms per call ({ROWS} rows)')
+
+
+if __name__ == '__main__':
+    bench('construct', construct, 20)
+    elem = construct()
+    bench('render', lambda: render(elem), 10)
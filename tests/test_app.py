@@ -1,9 +1,35 @@
+import asyncio
+import gc
 import json
 import re
+from urllib.parse import quote
 
+import pytest
 from starlette.testclient import TestClient
 
 from example import app
+from vivi import Vivi
+from vivi.elements import component, h, suspense
+from vivi.events import (
+    Handlers, client, debounce, delta, fields, hide, keys, prevent_default,
+    toggle_class,
+)
+from vivi.hooks import (
+    use_state, use_callback, use_ref, use_signal, use_transition,
+)
+from vivi.html import (
+    HTMLNode, IDENTITY, NO_MAPPING, clean_node, html_diff, html_payloads,
+)
+from vivi.test import TestSession
+
+
+def connect(client, res):
+    # connects to the websocket of the session the page was rendered for
+    socket_url = json.loads(re.search(
+        r'new WebSocket\(("(?:[^"\\]|\\.)*")\)', res.content.decode(),
+    ).group(1))
+    assert socket_url.startswith('ws://testserver/')
+    return client.websocket_connect(socket_url[len('ws://testserver'):])
 
 
 def test_counter():
@@ -29,46 +55,46 @@ def test_counter():
             '<body>'
             '<ul class="nav">'
             '<li>'
-            '<a href="/counters" onclick="call(event, true, false)" '
+            '<a href="/counters" onclick="call(event, true, false, 0)" '
             'class="active">'
             'Counters'
             '</a>'
             '</li>'
             '<li>'
-            '<a href="/greeter" onclick="call(event, true, false)">'
+            '<a href="/greeter" onclick="call(event, true, false, 1)">'
             'Greeter'
             '</a>'
             '</li>'
             '<li>'
-            '<a href="/io" onclick="call(event, true, false)">IO</a>'
+            '<a href="/io" onclick="call(event, true, false, 2)">IO</a>'
             '</li>'
             '<li>'
-            '<a href="/cookies" onclick="call(event, true, false)">'
+            '<a href="/cookies" onclick="call(event, true, false, 3)">'
             'Cookies'
             '</a>'
             '</li>'
             '<li>'
-            '<a href="/file-upload" onclick="call(event, true, false)">'
+            '<a href="/file-upload" onclick="call(event, true, false, 4)">'
             'File Upload'
             '</a>'
             '</li>'
             '<li>'
-            '<a href="/chat" onclick="call(event, true, false)">'
+            '<a href="/chat" onclick="call(event, true, false, 5)">'
             'Chat'
             '</a>'
             '</li>'
             '</ul>'
             '<h1>Counter 1</h1>'
             '<div>'
-            '<button onclick="call(event, false, false)">-</button>'
+            '<button onclick="call(event, false, false, 6)">-</button>'
             ' count: 0 '
-            '<button onclick="call(event, false, false)">+</button>'
+            '<button onclick="call(event, false, false, 7)">+</button>'
             '</div>'
             '<h1>Counter 2</h1>'
             '<div>'
-            '<button onclick="call(event, false, false)">-</button>'
+            '<button onclick="call(event, false, false, 8)">-</button>'
             ' count: 10 '
-            '<button onclick="call(event, false, false)">+</button>'
+            '<button onclick="call(event, false, false, 9)">+</button>'
             '</div>'
             '</body>'
             '</html>'
@@ -80,19 +106,19 @@ def test_counter():
 
         with client.websocket_connect(socket_path) as socket:
             # Increment first counter
-            socket.send_json(['click', 1, 1, 2, 2, {}])
+            socket.send_json(['click', 1, 1, 2, 2, {'handler': 7}])
             assert socket.receive_json() == [
                 ['replace', 1, 1, 2, 1, ' count: 1 '],
             ]
             # Go to greeter page
-            socket.send_json(["click", 1, 1, 0, 1, 0, {}])
+            socket.send_json(["click", 1, 1, 0, 1, 0, {'handler': 1}])
             assert socket.receive_json() == [
                 ['push_url', '/greeter'],
                 ['unset', 1, 1, 0, 0, 0, 'class'],
                 ['set', 1, 1, 0, 1, 0, 'class', 'active'],
                 ['replace', 1, 1, 1, ['h1', {}, 'Greeter']],
                 ['replace', 1, 1, 2, ['input', {
-                    'oninput': 'call(event, true, false)',
+                    'oninput': 'call(event, true, false, 10)',
                     'value': '',
                 }]],
                 ['replace', 1, 1, 3, ['div', {}, 'Hello, !']],
@@ -102,8 +128,749 @@ def test_counter():
                 ['focus', 1, 1, 2],
             ]
             # Type world
-            socket.send_json(["input", 1, 1, 2, {'value': 'World'}])
+            socket.send_json(
+                ["input", 1, 1, 2, {'value': 'World', 'handler': 10}],
+            )
+            # the value the client reported is not echoed back
             assert socket.receive_json() == [
-                ['set', 1, 1, 2, 'value', 'World'],
                 ['replace', 1, 1, 3, 0, 'Hello, World!'],
             ]
+
+
+@component
+def item(value):
+    return h.li(value)
+
+
+@component
+def items():
+    count, set_count = use_state(1)
+
+    @use_callback(set_count)
+    def onclick(e):
+        set_count(lambda count: count + 1)
+
+    return h.div(
+        h.button(onclick=onclick)('add'),
+        h.ul([item(key=index, value=index) for index in range(count)]),
+    )
+
+
+def test_render_budget():
+    with TestClient(Vivi(items, render_budget=0)) as client:
+        res = client.get('/')
+        assert res.status_code == 200
+
+        with connect(client, res) as socket:
+            # With no budget every component is rendered in a separate pass,
+            # the changes should still arrive as a single update
+            socket.send_json(['click', 1, 1, 0, 0, {}])
+            assert socket.receive_json() == [
+                ['insert', 1, 1, 0, 1, 1, ['li', {}, '1']],
+            ]
+            # once the shape of an inserted node repeats it becomes a template
+            # that later nodes of the same shape only send their values for
+            socket.send_json(['click', 1, 1, 0, 0, {}])
+            assert socket.receive_json() == [
+                ['insert', 1, 1, 0, 1, 2, {
+                    'define': 0,
+                    'node': ['li', {}, '2'],
+                }],
+            ]
+            socket.send_json(['click', 1, 1, 0, 0, {}])
+            assert socket.receive_json() == [
+                ['insert', 1, 1, 0, 1, 3, [0, '3']],
+            ]
+
+
+def test_node_ids():
+    with TestClient(Vivi(items, node_ids=True)) as client:
+        res = client.get('/')
+        assert res.status_code == 200
+
+        with connect(client, res) as socket:
+            # elements are numbered in document order: the document is 0,
+            # followed by html, head, script, body, div, button and ul
+            socket.send_json(['click', 6, {}])
+            assert socket.receive_json() == [
+                ['insert', 7, 1, ['li', {}, '1']],
+            ]
+            socket.send_json(['click', 6, {}])
+            assert socket.receive_json() == [
+                ['insert', 7, 2, {'define': 0, 'node': ['li', {}, '2']}],
+            ]
+            # ids the server does not know are ignored like handlers that are
+            # no longer rendered
+            socket.send_json(['click', 100, {}])
+            socket.send_json(['click', 6, {'target': [100]}])
+            socket.send_json(['click', 6, {}])
+            assert socket.receive_json() == [
+                ['insert', 7, 3, [0, '3']],
+            ]
+
+
+@component
+def echo():
+    text, set_text = use_state('')
+
+    @use_callback(set_text)
+    @fields('value')
+    def oninput(e):
+        set_text(e.value)
+
+    return h.div(h.input(value=text, oninput=oninput), h.p(text))
+
+
+def test_delegate_events():
+    with TestClient(Vivi(echo, delegate_events=True)) as client:
+        res = client.get('/')
+        assert res.status_code == 200
+
+        # handlers are rendered as data attributes that the listener on the
+        # document picks up, together with the fields the handler needs
+        content = res.content.decode()
+        assert '<input value="" data-oninput="0 fields=value">' in content
+
+        with connect(client, res) as socket:
+            socket.send_json(
+                ['input', 1, 1, 0, 0, {'handler': 0, 'value': 'a'}],
+            )
+            assert socket.receive_json() == [
+                ['insert', 1, 1, 0, 1, 0, 'a'],
+            ]
+
+
+@component
+def upper():
+    text, set_text = use_state('')
+
+    @use_callback(set_text)
+    def oninput(e):
+        set_text(e.value.upper())
+
+    return h.div(h.input(value=text, oninput=oninput), h.p(text))
+
+
+def test_input_echo():
+    with TestClient(Vivi(upper)) as client:
+        res = client.get('/')
+        assert res.status_code == 200
+
+        with connect(client, res) as socket:
+            # the value differs from the one the client reported so it is set
+            socket.send_json(
+                ['input', 1, 1, 0, 0, {'handler': 0, 'value': 'a'}],
+            )
+            assert socket.receive_json() == [
+                ['set', 1, 1, 0, 0, 'value', 'A'],
+                ['insert', 1, 1, 0, 1, 0, 'A'],
+            ]
+            # the value is the same as the one the client reported so it is
+            # not sent back
+            socket.send_json(
+                ['input', 1, 1, 0, 0, {'handler': 0, 'value': 'AB'}],
+            )
+            assert socket.receive_json() == [
+                ['replace', 1, 1, 0, 1, 0, 'AB'],
+            ]
+
+
+@component
+def editor():
+    text, set_text = use_state('')
+
+    @use_callback(set_text)
+    @delta
+    def oninput(e):
+        set_text(e.value)
+
+    @use_callback(set_text)
+    def onreset(e):
+        set_text('')
+
+    return h.div(
+        h.p('done') if text.endswith('!') else h.textarea(oninput=oninput),
+        h.p(len(text)),
+        h.button(onclick=onreset)('reset'),
+    )
+
+
+def test_delta_input():
+    with TestClient(Vivi(editor)) as client:
+        res = client.get('/')
+        assert res.status_code == 200
+        assert (
+            '<textarea oninput="call(event, false, false, 0, '
+            '&quot;delta&quot;)">'
+        ) in res.content.decode()
+
+        with connect(client, res) as socket:
+            # the first event has the full value, later events only the edit
+            # as offset, delete count and inserted text
+            socket.send_json(
+                ['input', 1, 1, 0, 0, {'handler': 0, 'delta': [0, 'a' * 100]}],
+            )
+            assert socket.receive_json() == [['replace', 1, 1, 0, 1, 0, '100']]
+            socket.send_json([
+                'input', 1, 1, 0, 0,
+                {'handler': 0, 'delta': [0, 50, 10, 'b']},
+            ])
+            assert socket.receive_json() == [['replace', 1, 1, 0, 1, 0, '91']]
+
+            # an edit of an input the server does not have a value for is
+            # ignored, like an edit of an input that is no longer rendered
+            socket.send_json([
+                'input', 1, 1, 0, 0,
+                {'handler': 0, 'delta': [1, 0, 0, 'c']},
+            ])
+            socket.send_json([
+                'input', 1, 1, 0, 0,
+                {'handler': 0, 'delta': [0, 91, 0, '!']},
+            ])
+            assert socket.receive_json() == [
+                ['replace', 1, 1, 0, 0, ['p', {}, 'done']],
+                ['replace', 1, 1, 0, 1, 0, '92'],
+            ]
+            socket.send_json([
+                'input', 1, 1, 0, 0,
+                {'handler': 0, 'delta': [0, 0, 0, 'd']},
+            ])
+            socket.send_json(['click', 1, 1, 0, 2, {'handler': 1}])
+            assert socket.receive_json() == [
+                ['replace', 1, 1, 0, 0, ['textarea', {
+                    'oninput': 'call(event, false, false, 2, "delta")',
+                }]],
+                ['replace', 1, 1, 0, 1, 0, '0'],
+            ]
+
+
+@component
+def signup():
+    submitted, set_submitted = use_state(None)
+
+    @use_callback(set_submitted)
+    @prevent_default
+    def onsubmit(e):
+        set_submitted(e.values)
+
+    return h.form(onsubmit=onsubmit)(
+        h.input(name='email'),
+        h.input(name='tags', type='checkbox', value='a', checked=True),
+        h.input(name='tags', type='checkbox', value='b', checked=True),
+        h.input(name='tags', type='checkbox', value='c'),
+        h.input(name='plan', type='radio', value='free', checked=True),
+        h.input(name='plan', type='radio', value='pro'),
+        h.textarea(name='note', value='none'),
+        h.button(type='submit')('sign up'),
+        h.p(repr(submitted)),
+    )
+
+
+def test_uncontrolled_form():
+    with TestSession(signup) as session:
+        # the input has no callback, its value is only sent on submit
+        assert session.find('input[name="email"]').input('a@b.c')
+        assert session.find('button').click()
+        assert session.find('p').has_text(repr({
+            'email': 'a@b.c',
+            'tags': ['a', 'b'],
+            'plan': 'free',
+            'note': 'none',
+        }))
+
+
+def test_uncontrolled_checkboxes():
+    with TestSession(signup) as session:
+        # the inputs have no callbacks, the server only sees what was clicked
+        # when the form is submitted
+        assert session.find('input[value="b"]').click()
+        assert session.find('input[value="c"]').click()
+        assert session.find('input[value="pro"]').click()
+        assert session.find('button').click()
+        assert session.find('p').has_text(repr({
+            'email': '',
+            'tags': ['a', 'c'],
+            'plan': 'pro',
+            'note': 'none',
+        }))
+
+        assert session.find('input[value="c"]').click()
+        assert session.find('input[value="free"]').click()
+        assert session.find('input[value="free"]').click()
+        assert session.find('button').click()
+        assert session.find('p').has_text(repr({
+            'email': '',
+            'tags': 'a',
+            'plan': 'free',
+            'note': 'none',
+        }))
+
+
+@component
+def menu():
+    count, set_count = use_state(0)
+
+    @use_callback(set_count)
+    @client(hide('.menu'))
+    def onclick(e):
+        set_count(lambda count: count + 1)
+
+    return h.div(
+        h.button(onclick=client(toggle_class('open', '.menu')))('menu'),
+        h.ul(
+            {'class': 'menu' if count < 2 else 'menu full'},
+            h.li(onclick=onclick)(count),
+        ),
+    )
+
+
+def test_client_actions():
+    with TestClient(Vivi(menu, delegate_events=True)) as client:
+        res = client.get('/')
+        assert res.status_code == 200
+        content = res.content.decode()
+        # the button only has client actions so it has no handler id
+        assert (
+            '<button data-onclick="- client=' +
+            quote('[["toggle_class",".menu","open"]]', safe='') + '">'
+        ) in content
+        assert (
+            '<li data-onclick="0 client=' +
+            quote('[["hide",".menu"]]', safe='') + '">'
+        ) in content
+
+    with TestSession(menu) as session:
+        assert session.find('button').click()
+        assert session.find('li').has_text('0')
+        assert session.find('li').click()
+        assert session.find('li').has_text('1')
+
+
+def test_client_actions_rerender():
+    with TestClient(Vivi(menu, delegate_events=True)) as client:
+        res = client.get('/')
+        assert res.status_code == 200
+
+        with connect(client, res) as socket:
+            # the client toggled the open class and hid the menu, the server
+            # does not render these changes so it leaves them alone
+            socket.send_json(['click', 1, 1, 0, 1, 0, {'handler': 0}])
+            assert socket.receive_json() == [
+                ['replace', 1, 1, 0, 1, 0, 0, '1'],
+            ]
+
+            # once the server changes the class it sends its whole value, which
+            # replaces the class that the client toggled
+            socket.send_json(['click', 1, 1, 0, 1, 0, {'handler': 0}])
+            assert socket.receive_json() == [
+                ['set', 1, 1, 0, 1, 'class', 'menu full'],
+                ['replace', 1, 1, 0, 1, 0, 0, '2'],
+            ]
+
+
+@component
+def transition_value(value):
+    return h.li(value)
+
+
+@component
+def transition_button(count, set_value):
+    _, start_transition = use_transition()
+
+    @use_callback(set_value, start_transition)
+    def onclick(e):
+        start_transition(lambda: set_value(lambda value: value + 1))
+
+    return h.button(onclick=onclick)(count)
+
+
+@component
+def interrupted_transition():
+    count = use_signal(0)
+    value, set_value = use_state(0)
+
+    # an urgent update that comes in after the first transition pass
+    ref = use_ref(value=value)
+    if ref.value != value:
+        ref.value = value
+        asyncio.get_running_loop().call_soon(
+            count.set, lambda count: count + 1,
+        )
+
+    return h.div(
+        transition_button(count=count, set_value=set_value),
+        h.p(value),
+        h.ul(transition_value(value=value), transition_value(value=value)),
+    )
+
+
+def test_interrupted_transition():
+    with TestClient(Vivi(interrupted_transition, render_budget=0)) as client:
+        res = client.get('/')
+        assert res.status_code == 200
+
+        with connect(client, res) as socket:
+            # the first pass of the transition only got to the p, the urgent
+            # update is rendered without it so the p and the items agree
+            socket.send_json(['click', 1, 1, 0, 0, {}])
+            assert socket.receive_json() == [
+                ['replace', 1, 1, 0, 0, 0, '1'],
+            ]
+            # then the transition starts over and is sent as a whole
+            assert socket.receive_json() == [
+                ['replace', 1, 1, 0, 1, 0, '1'],
+                ['replace', 1, 1, 0, 2, 0, 0, '1'],
+                ['replace', 1, 1, 0, 2, 1, 0, '1'],
+            ]
+
+
+@component
+def table():
+    shown, set_shown = use_state(False)
+
+    @use_callback(set_shown)
+    def onclick(e):
+        set_shown(True)
+
+    return h.div(
+        h.button(onclick=onclick)('show'),
+        h.table(
+            h.tbody([h.tr(h.td(i), h.td('<', i)) for i in range(50)])
+            if shown else
+            None
+        ),
+    )
+
+
+def test_html_payload():
+    with TestClient(Vivi(table)) as client:
+        res = client.get('/')
+        assert res.status_code == 200
+
+        with connect(client, res) as socket:
+            # the inserted subtree is big enough to be sent as html
+            socket.send_json(['click', 1, 1, 0, 0, {'handler': 0}])
+            (action, *path, index, payload), = socket.receive_json()
+            assert (action, path, index) == ('insert', [1, 1, 0, 1], 0)
+            assert payload == {'html': (
+                '<tbody>' +
+                ''.join(
+                    f'<tr><td>{i}</td><td>&lt;{i}</td></tr>'
+                    for i in range(50)
+                ) +
+                '</tbody>'
+            )}
+
+
+def test_html_payload_content_model():
+    rows = [('tr', {}, ('td', {}, str(i))) for i in range(40)]
+
+    def payload(data):
+        (*_, payload), = html_payloads([('insert', 0, data)], min_size=1)
+        return payload
+
+    # the parser would insert a tbody, so the subtree is sent as is
+    assert payload(('table', {}, *rows)) == ('table', {}, *rows)
+    assert payload(('table', {}, ('tbody', {}, *rows))) == {'html': (
+        '<table><tbody>' +
+        ''.join(f'<tr><td>{i}</td></tr>' for i in range(40)) +
+        '</tbody></table>'
+    )}
+    # on their own the rows are parsed in a template so they are kept
+    assert payload(rows[0]) == {'html': '<tr><td>0</td></tr>'}
+
+    for data in [
+        # block elements close a p
+        ('p', {}, ('span', {}, ('div', {}, 'text'))),
+        ('p', {}, ('p', {})),
+        # links and forms do not nest
+        ('a', {}, ('span', {}, ('a', {}, 'text'))),
+        ('form', {}, ('div', {}, ('form', {}))),
+        # text in a table is moved in front of it
+        ('table', {}, ('tbody', {}, ('tr', {}, 'text'))),
+        # a select only keeps its options
+        ('select', {}, ('div', {}, 'text')),
+        # table elements are dropped outside of a table
+        ('div', {}, ('td', {}, 'text')),
+    ]:
+        assert payload(data) == data
+
+    # lists end the reach of an outer li
+    assert payload(('li', {}, ('ul', {}, ('li', {}, 'text')))) == {
+        'html': '<li><ul><li>text</li></ul></li>',
+    }
+
+
+@component
+def shortcuts():
+    pressed, set_pressed = use_state(())
+
+    @use_callback(set_pressed)
+    @keys('Enter', ' ')
+    @prevent_default
+    def onkeydown(e):
+        set_pressed(lambda pressed: (*pressed, e.key))
+
+    @debounce(200)
+    def oninput(e):
+        pass
+
+    return h.div(
+        h.input(onkeydown=onkeydown, oninput=oninput),
+        h.p(', '.join(map(repr, pressed))),
+    )
+
+
+def test_event_options():
+    with TestClient(Vivi(shortcuts, delegate_events=True)) as client:
+        res = client.get('/')
+        assert res.status_code == 200
+        assert (
+            '<input data-onkeydown="0 p keys=Enter,%20" '
+            'data-oninput="1 debounce=200">'
+        ) in res.content.decode()
+
+    with TestSession(shortcuts) as session:
+        assert session.find('input').keydown('a')
+        assert session.find('input').keydown('Enter')
+        assert session.find('input').keydown(' ')
+        assert session.find('p').has_text("'Enter', ' '")
+
+
+@component
+def two_buttons():
+    count, set_count = use_state(0)
+
+    def increment(e):
+        set_count(lambda count: count + 1)
+
+    def decrement(e):
+        set_count(lambda count: count - 1)
+
+    # the callbacks are recreated on every render
+    return h.div(
+        h.button(onclick=prevent_default(increment))(f'+ {count}'),
+        h.button(onclick=decrement)(f'- {count}'),
+    )
+
+
+def test_handler_ids_survive_rerenders():
+    with TestClient(Vivi(two_buttons)) as client:
+        res = client.get('/')
+        assert res.status_code == 200
+        assert (
+            '<button onclick="call(event, true, false, 0)">+ 0</button>'
+            '<button onclick="call(event, false, false, 1)">- 0</button>'
+        ) in res.content.decode()
+
+        with connect(client, res) as socket:
+            # the ids stay the same so only the texts change
+            for handler_id, count in [(1, -1), (0, 0), (1, -1), (1, -2)]:
+                socket.send_json(
+                    ['click', 1, 1, 0, handler_id, {'handler': handler_id}],
+                )
+                assert socket.receive_json() == [
+                    ['replace', 1, 1, 0, 0, 0, f'+ {count}'],
+                    ['replace', 1, 1, 0, 1, 0, f'- {count}'],
+                ]
+                gc.collect()
+
+            # a click that is sent before the previous rerender arrived still
+            # finds the callback of the current render
+            socket.send_json(['click', 1, 1, 0, 0, {'handler': 0}])
+            socket.send_json(['click', 1, 1, 0, 0, {'handler': 0}])
+            actions = socket.receive_json()
+            if actions[0][-1] != '+ 0':
+                actions = socket.receive_json()
+            assert actions == [
+                ['replace', 1, 1, 0, 0, 0, '+ 0'],
+                ['replace', 1, 1, 0, 1, 0, '- 0'],
+            ]
+
+            # an id that is not known falls back to the callback at the path
+            socket.send_json(['click', 1, 1, 0, 0, {'handler': 100}])
+            assert socket.receive_json() == [
+                ['replace', 1, 1, 0, 0, 0, '+ 1'],
+                ['replace', 1, 1, 0, 1, 0, '- 1'],
+            ]
+
+
+def test_handlers_forget_unrendered_callbacks():
+    handlers = Handlers()
+    # builtins cannot be weakly referenced, they are kept for the node instead
+    old_node = HTMLNode(None, {}, NO_MAPPING, (
+        HTMLNode('button', {'onclick': print}, NO_MAPPING, ()),
+    ))
+    new_node = HTMLNode(None, {}, IDENTITY, (
+        HTMLNode('button', {'onclick': repr}, NO_MAPPING, ()),
+    ))
+
+    assert clean_node(old_node.children[0], handlers) == (
+        'button', {'onclick': 'call(event, false, false, 0)'},
+    )
+    # the new button takes over the id of the old one
+    assert list(html_diff(old_node, new_node, handlers=handlers)) == []
+    assert handlers[0] is repr
+
+    del old_node
+    assert handlers[0] is repr
+    del new_node
+    with pytest.raises(KeyError):
+        handlers[0]
+
+
+@component
+async def delayed(text, delay):
+    await asyncio.sleep(delay)
+    return text
+
+
+@component
+def delayed_items():
+    return h.ul(
+        h.li(suspense(fallback='loading')(delayed(text='fast', delay=0))),
+        h.li(suspense(fallback='loading')(delayed(text='slow', delay=0.5))),
+    )
+
+
+def test_eager_timeout():
+    with TestClient(Vivi(delayed_items, eager_timeout=0.1)) as client:
+        res = client.get('/')
+        assert res.status_code == 200
+
+        # the slow component did not resolve before the deadline so it is
+        # streamed in afterwards as a script that applies the diff
+        page, stream = res.content.decode().split('</html>')
+        assert page.endswith('<ul><li>fast</li><li>loading</li></ul></body>')
+        assert stream == (
+            '<script>handleStream([["replace",1,1,0,1,0,"slow"]]);</script>'
+        )
+
+
+@component
+async def loaded(n, count):
+    await asyncio.sleep(0)
+    if n:
+        # the signal below updates in the same render as the one that shows
+        # the children again
+        asyncio.get_running_loop().call_soon(count.set, lambda c: c + 1)
+    return h.span(n)
+
+
+@component
+def suspended_sibling():
+    clicks, set_clicks = use_state(0)
+
+    @use_callback(set_clicks)
+    def onclick(e):
+        set_clicks(lambda clicks: clicks + 1)
+
+    return h.button(onclick=onclick)(clicks)
+
+
+@component
+def suspense_toggle():
+    n, set_n = use_state(0)
+    count = use_signal(0)
+
+    @use_callback(set_n)
+    def onclick(e):
+        set_n(lambda n: n + 1)
+
+    return h.div(
+        h.button(onclick=onclick)('next'),
+        suspense(fallback='loading')(
+            suspended_sibling(), loaded(n=n, count=count), h.b(count),
+        ),
+    )
+
+
+def test_suspense_toggle():
+    with TestClient(Vivi(suspense_toggle)) as client:
+        res = client.get('/')
+        assert res.status_code == 200
+
+        content = res.content.decode()
+        assert content.endswith(
+            '<div><button onclick="call(event, false, false, 0)">next</button>'
+            '<button onclick="call(event, false, false, 1)">0</button>'
+            '<span>0</span><b>0</b></div></body></html>'
+        )
+
+        with connect(client, res) as socket:
+            socket.send_json(['click', 1, 1, 0, 0, {}])
+            assert socket.receive_json() == [
+                ['replace', 1, 1, 0, 1, 'loading'],
+                ['remove', 1, 1, 0, 2],
+                ['remove', 1, 1, 0, 2],
+            ]
+            # the children are new to the client, also the parts of them that
+            # were rendered again after the boundary switched in this render
+            assert socket.receive_json() == [
+                ['replace', 1, 1, 0, 1, ['button', {
+                    'onclick': 'call(event, false, false, 1)',
+                }, '0']],
+                ['insert', 1, 1, 0, 2, ['span', {}, '1']],
+                ['insert', 1, 1, 0, 3, ['b', {}, '1']],
+            ]
+
+            socket.send_json(['click', 1, 1, 0, 1, {}])
+            assert socket.receive_json() == [
+                ['replace', 1, 1, 0, 1, 0, '1'],
+            ]
+            socket.send_json(['click', 1, 1, 0, 0, {}])
+            assert socket.receive_json() == [
+                ['replace', 1, 1, 0, 1, 'loading'],
+                ['remove', 1, 1, 0, 2],
+                ['remove', 1, 1, 0, 2],
+            ]
+            # the sibling kept its state while the fallback was shown
+            assert socket.receive_json() == [
+                ['replace', 1, 1, 0, 1, {'define': 0, 'node': ['button', {
+                    'onclick': 'call(event, false, false, 1)',
+                }, '1']}],
+                ['insert', 1, 1, 0, 2, {'define': 1, 'node': [
+                    'span', {}, '2',
+                ]}],
+                ['insert', 1, 1, 0, 3, {'define': 2, 'node': [
+                    'b', {}, '2',
+                ]}],
+            ]
+
+
+@component
+def hanging_counter():
+    count, set_count = use_state(0)
+
+    @use_callback()
+    def increment(e):
+        set_count(lambda count: count + 1)
+
+    return h.div(
+        h.button(onclick=increment)(f'{count}'),
+        suspense(fallback='loading')(delayed(text='never', delay=3600)),
+    )
+
+
+def test_hanging_eager_future():
+    app = Vivi(hanging_counter, eager_timeout=0.1, stream_timeout=0.1)
+    with TestClient(app) as client:
+        # the stream gives up on the future after the stream timeout
+        res = client.get('/')
+        assert res.status_code == 200
+
+        content = res.content.decode()
+        page, stream = content.split('</html>')
+        assert page.endswith(
+            '<div><button onclick="call(event, false, false, 0)">0</button>'
+            'loading</div></body>'
+        )
+        assert stream == ''
+
+        with connect(client, res) as socket:
+            # the websocket took over and handles events while the future is
+            # still loading
+            socket.send_json(['click', 1, 1, 0, 0, {}])
+            assert socket.receive_json() == [
+                ['replace', 1, 1, 0, 0, 0, '1'],
+            ]
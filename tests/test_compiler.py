@@ -0,0 +1,239 @@
+from functools import wraps
+
+from vivi.compiler import compiled, TemplateElement
+from vivi.elements import component, h, HTMLElement
+from vivi.hooks import use_state, use_callback
+from vivi.html import html_parts
+from vivi.test import TestSession
+
+
+@component
+@compiled
+def counter():
+    count, set_count = use_state(0)
+
+    @use_callback(set_count)
+    def onclick(e):
+        set_count(lambda count: count + 1)
+
+    return h.div({'class': 'counter'})(
+        h.h1('Counter'),
+        h.button(onclick=onclick)(f'count: {count}'),
+        [h.span(key=i)(i) for i in range(count)],
+    )
+
+
+def test_compiled_component():
+    assert counter._func is not counter._func.__wrapped__
+
+    with TestSession(counter) as session:
+        title = session.find('h1').get()._node
+
+        assert session.find('button').click()
+        assert session.find('button').has_text('count: 1')
+        assert session.find('span').has_text('0')
+
+        assert session.find('button').click()
+        assert session.find('button').has_text('count: 2')
+        assert len(session.find('span').all()) == 2
+
+        assert session.find('h1').get()._node is title
+
+
+def test_unsupported_return_is_not_compiled():
+    def func(tag):
+        return h[tag]('text')
+
+    assert compiled(func) is func
+
+
+def test_static_nodes_are_shared():
+    with TestSession(counter) as session, TestSession(counter) as other:
+        assert session.find('h1').get()._node is other.find('h1').get()._node
+        assert (
+            session.find('button').get()._node is not
+            other.find('button').get()._node
+        )
+
+
+def render(session):
+    session.all()
+    return ''.join(html_parts(session._result))
+
+
+def toggles():
+    shown, set_shown = use_state(False)
+
+    @use_callback(set_shown)
+    def onclick(e):
+        set_shown(lambda shown: not shown)
+
+    return h.div(
+        {'class': 'open'} if shown else {},
+        h.button(onclick=onclick)('toggle'),
+        h.p('details') if shown else 'hidden',
+        [h.span(key=i)(i) for i in range(3) if shown],
+    )
+
+
+def test_conditional_holes():
+    with TestSession(component(toggles)) as expected:
+        with TestSession(component(compiled(toggles))) as session:
+            assert session.find('div').not_has_prop('class')
+            assert session.find('div').has_text('togglehidden')
+            assert session.find('p').not_exists()
+            assert render(session) == render(expected)
+
+            for _ in range(2):
+                assert session.find('button').click()
+                assert expected.find('button').click()
+                assert session.find('div').has_prop('class', 'open')
+                assert session.find('p').has_text('details')
+                assert session.find('span').has_len(3)
+                assert render(session) == render(expected)
+
+                assert session.find('button').click()
+                assert expected.find('button').click()
+                assert session.find('div').not_has_prop('class')
+                assert session.find('p').not_exists()
+                assert session.find('span').not_exists()
+                assert render(session) == render(expected)
+
+
+@component
+@compiled
+def reorder():
+    items, set_items = use_state(('a', 'b', 'c'))
+
+    @use_callback(set_items)
+    def onclick(e):
+        set_items(lambda items: items[::-1])
+
+    return h.div(
+        h.button(onclick=onclick)('reverse'),
+        h.ul([h.li(key=item)(item) for item in items]),
+    )
+
+
+def test_keyed_children_reorder():
+    with TestSession(reorder) as session:
+        nodes = [node._node for node in session.find('li').all()]
+        assert [node.children for node in nodes] == [('a',), ('b',), ('c',)]
+
+        assert session.find('button').click()
+        assert session.find('ul').has_text('cba')
+        assert [node._node for node in session.find('li').all()] == [
+            *reversed(nodes),
+        ]
+
+
+order = []
+
+
+def log(value):
+    order.append(value)
+    return value
+
+
+def ordered():
+    return h.div({'id': log('id')}, log('a'), title=log('title'))(
+        h.span(log('b')),
+        {'class': log('class')},
+        log('c'),
+    )
+
+
+def test_evaluation_order():
+    order.clear()
+    ordered()
+    expected = order.copy()
+    assert expected == ['id', 'a', 'title', 'b', 'class', 'c']
+
+    order.clear()
+    compiled(ordered)()
+    assert order == expected
+
+
+def shadowed(h):
+    return h.div('text')
+
+
+def starred(children):
+    return h.div(*children)
+
+
+def mixed(tag):
+    def inner():
+        return h.span('inner')
+
+    if tag is None:
+        return h.div(inner())
+    return h[tag]('text')
+
+
+def test_unanalyzable_returns_fall_back():
+    assert compiled(shadowed) is shadowed
+    assert compiled(starred) is starred
+
+    func = compiled(mixed)
+    assert func is not mixed
+    assert isinstance(func(None), TemplateElement)
+    assert type(func(None)._values[0]) is HTMLElement
+    assert type(func('p')) is HTMLElement
+    assert func('p') == mixed('p')
+
+
+@component
+@compiled
+def events():
+    clicks, set_clicks = use_state(())
+    step, set_step = use_state(1)
+
+    @use_callback(set_clicks, step)
+    def onclick(e):
+        set_clicks(lambda clicks: (*clicks, step))
+
+    @use_callback(set_step)
+    def onstep(e):
+        set_step(lambda step: step + 1)
+
+    return h.div(
+        h.section(h.button({'class': 'add'}, onclick=onclick)('add')),
+        h.button({'class': 'step'}, onclick=onstep)('step'),
+        h.ol([h.li(key=i)(click) for i, click in enumerate(clicks)]),
+    )
+
+
+def test_events_in_template():
+    with TestSession(events) as session:
+        assert session.find('.add').click()
+        assert session.find('li').has_text('1')
+
+        assert session.find('.step').click()
+        assert session.find('.add').click()
+        assert session.find('ol').has_text('12')
+
+        assert session.find('.step').click()
+        assert session.find('.add').click()
+        assert session.find('ol').has_text('123')
+
+
+def shout(func):
+    @wraps(func)
+    def wrapper(**props):
+        return func(**{key: value.upper() for key, value in props.items()})
+    return wrapper
+
+
+@component
+@compiled
+@shout
+def greet(name):
+    return h.p('hello ', name)
+
+
+def test_wrapped_function_is_not_compiled():
+    assert compiled(greet._func) is greet._func
+
+    with TestSession(greet(name='world')) as session:
+        assert session.find('p').has_text('hello WORLD')
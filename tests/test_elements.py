@@ -0,0 +1,260 @@
+import asyncio
+from functools import partial
+
+from vivi.elements import component, h, suspense
+from vivi.hooks import (
+    use_state, use_callback, use_signal, use_transition, use_deferred_value,
+)
+from vivi.test import TestSession
+
+
+@component
+def ignore_value(value):
+    return h.li('static')
+
+
+@component
+def increment_button():
+    count, set_count = use_state(0)
+
+    @use_callback(set_count)
+    def onclick(e):
+        set_count(lambda count: count + 1)
+
+    return h.div(
+        h.button(onclick=onclick)(f'count: {count}'),
+        h.ul(ignore_value(value=count)),
+    )
+
+
+def test_unchanged_subtree_keeps_result():
+    with TestSession(increment_button) as session:
+        result = session.find('ul').get()._node
+
+        assert session.find('button').click()
+        assert session.find('button').has_text('count: 1')
+        assert session.find('ul').get()._node is result
+
+
+def test_equal_elements_have_equal_hashes():
+    elem = h.div({'class': ['a', 'b']}, style={'color': 'red'})(
+        ignore_value(value=[1, 2]), 'text',
+    )
+    other = h.div({'class': ['a', 'b']}, style={'color': 'red'})(
+        ignore_value(value=[1, 2]), 'text',
+    )
+
+    assert hash(elem) == hash(other)
+    assert elem == other
+    assert elem != h.div({'class': ['a', 'c']}, style={'color': 'red'})(
+        ignore_value(value=[1, 2]), 'text',
+    )
+
+
+renders = []
+
+
+@component
+def progress():
+    value = use_signal(0)
+    renders.append(value)
+
+    @use_callback(value)
+    def onclick(e):
+        value.set(lambda value: value + 10)
+
+    return h.div(
+        h.progress(value=value, max=100),
+        h.button(onclick=onclick)('progress: ', value, '%'),
+    )
+
+
+def test_signal_updates_without_rerender():
+    renders.clear()
+
+    with TestSession(progress) as session:
+        assert session.find('progress').has_prop('value', 0)
+        assert session.find('button').has_text('progress: 0%')
+
+        assert session.find('button').click()
+        assert session.find('button').has_text('progress: 10%')
+        assert session.find('progress').has_prop('value', 10)
+
+        assert session.find('button').click()
+        assert session.find('button').has_text('progress: 20%')
+        assert session.find('progress').has_prop('value', 20)
+
+    assert len(renders) == 1
+
+
+@component
+def deferred_count():
+    count, set_count = use_state(0)
+    deferred = use_deferred_value(count)
+    pending, start_transition = use_transition()
+
+    @use_callback(set_count)
+    def onclick(e):
+        set_count(lambda count: count + 1)
+
+    @use_callback(set_count, start_transition)
+    def onreset(e):
+        start_transition(lambda: set_count(0))
+
+    return h.div(
+        h.button({'class': 'count'}, onclick=onclick)('count: ', count),
+        h.span({'class': 'deferred'})('deferred: ', deferred),
+        h.button({'class': 'reset'}, onclick=onreset)('reset'),
+        h.span({'class': 'pending'})('pending' if pending else 'idle'),
+    )
+
+
+def test_deferred_value_and_transition():
+    with TestSession(deferred_count) as session:
+        assert session.find('.count').click()
+        assert session.find('.count').has_text('count: 1')
+        assert session.find('.deferred').has_text('deferred: 1')
+
+        assert session.find('.reset').click()
+        assert session.find('.count').has_text('count: 0')
+        assert session.find('.pending').has_text('idle')
+
+
+@component
+async def delayed(text, delay):
+    await asyncio.sleep(delay)
+    return h.span(text)
+
+
+@component
+def widgets():
+    return h.div(
+        h.section({'class': 'a'})(
+            suspense(fallback='loading')(delayed(text='a', delay=0.1)),
+        ),
+        h.section({'class': 'b'})(
+            suspense(fallback='loading')(
+                delayed(text='b', delay=0.1),
+                delayed(text='c', delay=60),
+            ),
+        ),
+    )
+
+
+def test_suspense():
+    with TestSession(widgets) as session:
+        assert session.find('.a').has_text('loading')
+        assert session.find('.b').has_text('loading')
+
+        assert session.find('.a span').has_text('a')
+        assert session.find('.b').has_text('loading')
+        assert session.find('.b span').not_exists()
+
+
+ref_nodes = []
+
+
+@component
+def toggle_ref():
+    shown, set_shown = use_state(False)
+
+    @use_callback(set_shown)
+    def onclick(e):
+        set_shown(lambda shown: not shown)
+
+    return h.div(
+        h.button(onclick=onclick)('toggle'),
+        h.ul(h.li(h.span(ref=ref_nodes.append)('ref')) if shown else None),
+    )
+
+
+def test_ref_in_nested_branch():
+    ref_nodes.clear()
+
+    with TestSession(toggle_ref) as session:
+        assert session.find('button').click()
+        assert session.find('span').has_text('ref')
+        assert session.find('button').click()
+        assert session.find('span').not_exists()
+
+    assert len(ref_nodes) == 2
+    assert ref_nodes[0].tag == 'span'
+    assert ref_nodes[1] is None
+
+
+@component
+def static_list():
+    return h.section(h.ul(h.li(ref=ref_nodes.append)('item')))
+
+
+@component
+def ref_sibling():
+    count, set_count = use_state(0)
+
+    @use_callback(set_count)
+    def onclick(e):
+        set_count(lambda count: count + 1)
+
+    return h.div(
+        h.button(onclick=onclick)(f'count: {count}'),
+        static_list(),
+    )
+
+
+def test_ref_survives_sibling_rerender():
+    ref_nodes.clear()
+
+    with TestSession(ref_sibling) as session:
+        assert session.find('button').click()
+        assert session.find('button').has_text('count: 1')
+
+        # the subtree of the list was reused, so the ref still is the item
+        ref_node, = ref_nodes
+        assert ref_node.tag == 'li'
+        assert ref_node.text() == 'item'
+
+
+refs = {}
+first_ref = partial(refs.__setitem__, 'first')
+second_ref = partial(refs.__setitem__, 'second')
+count_ref = partial(refs.__setitem__, 'count')
+
+
+@component
+def static_items():
+    return h.section(h.ul(
+        h.li(ref=first_ref)('first'),
+        h.li(ref=second_ref)('second'),
+    ))
+
+
+@component
+def ref_siblings():
+    count, set_count = use_state(0)
+
+    @use_callback(set_count)
+    def onclick(e):
+        set_count(lambda count: count + 1)
+
+    return h.div(
+        h.button(onclick=onclick)(h.span(ref=count_ref)(count)),
+        static_items(),
+    )
+
+
+def test_remap_nodes_below_reused_subtree():
+    refs.clear()
+
+    with TestSession(ref_siblings) as session:
+        for count in range(1, 4):
+            assert session.find('button').click()
+            assert session.find('button').has_text(str(count))
+
+            # the nodes in the reused subtree and the changed one share their
+            # parents and are remapped in the same pass
+            assert refs['first'].tag == 'li'
+            assert refs['first'].text() == 'first'
+            assert refs['second'].tag == 'li'
+            assert refs['second'].text() == 'second'
+            assert refs['count'].tag == 'span'
+            assert refs['count'].text() == str(count)
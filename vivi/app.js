@@ -1,13 +1,98 @@
-function createTree(node) {
-    return { node, children: Array.from(node.childNodes).map(createTree) };
+const { nodeIds, delegateEvents } = {{config}};
+// in node ids mode every element gets an id in document order, the server
+// assigns the same ids so actions and events can refer to nodes by id
+let nextId = 0;
+const idTrees = new Map();
+
+// mirror of the dom as the server sees it, every dom node maps to its tree so
+// paths can be resolved by walking up, the children of a tree are only
+// mirrored once they are needed (except in node ids mode where every element
+// needs its id right away)
+const trees = new WeakMap();
+
+// nodes that something else adds to the dom once it is mirrored (like browser
+// extensions or the streamed scripts) are not part of the result, the nodes
+// the server adds are mirrored right away so any added node without a tree is
+// left out when the children of its parent are mirrored later on
+const foreignNodes = new WeakSet();
+const observer = new MutationObserver(collectForeign);
+
+function collectForeign(records) {
+    for (const record of records) {
+        for (const node of record.addedNodes) {
+            if (!trees.has(node)) {
+                foreignNodes.add(node);
+            }
+        }
+    }
+}
+
+function createTree(node, parent, index) {
+    const tree = { node, parent, index, children: null, dirty: false };
+    trees.set(node, tree);
+    if (nodeIds && (node.nodeType === Node.ELEMENT_NODE || node === document)) {
+        tree.id = nextId++;
+        idTrees.set(tree.id, tree);
+        getChildren(tree);
+    }
+    return tree;
 }
+
+function getChildren(tree) {
+    if (tree.children === null) {
+        collectForeign(observer.takeRecords());
+        tree.children = Array.from(tree.node.childNodes)
+            .filter((node) => !foreignNodes.has(node))
+            .map((node, index) => createTree(node, tree, index));
+    }
+    return tree.children;
+}
+
+function forgetTree(tree) {
+    trees.delete(tree.node);
+    tree.parent = null;
+    if (nodeIds) {
+        const stack = [tree];
+        while (stack.length > 0) {
+            const tree = stack.pop();
+            if (tree.children !== null) {
+                idTrees.delete(tree.id);
+                stack.push(...tree.children);
+            }
+        }
+    }
+}
+
+function insertTree(parent, index, node) {
+    const children = getChildren(parent);
+    if (index !== children.length) {
+        parent.dirty = true;
+    }
+    children.splice(index, 0, createTree(node, parent, index));
+}
+
 let domTree = null;
+let loaded = false;
 let pendingActions = [];
+let flushScheduled = false;
+
+function initTree() {
+    observer.observe(document, { childList: true, subtree: true });
+    domTree = createTree(document, null, 0);
+    if (delegateEvents) {
+        for (const node of document.querySelectorAll('*')) {
+            delegateNode(node);
+        }
+    }
+}
 
 function getTree(path) {
+    if (nodeIds) {
+        return idTrees.get(path[0]);
+    }
     let tree = domTree;
     for (const index of path) {
-        tree = tree.children[index];
+        tree = getChildren(tree)[index];
     }
     return tree;
 }
@@ -16,38 +101,104 @@ function getNode(path) {
     return getTree(path).node;
 }
 
-function getPath(node) {
-    const nodes = [];
-    while (node.parentNode !== null) {
-        nodes.push(node);
-        node = node.parentNode;
+function getNodeTree(node) {
+    let tree = trees.get(node);
+    if (tree === undefined && node.parentNode !== null) {
+        const parent = getNodeTree(node.parentNode);
+        if (parent.children === null) {
+            getChildren(parent);
+            tree = trees.get(node);
+        }
     }
-
-    if (node !== document) {
+    if (tree === undefined) {
         throw new Error('node not in dom');
     }
+    return tree;
+}
+
+function getPath(node) {
+    let tree = getNodeTree(node);
+    if (nodeIds) {
+        return [tree.id];
+    }
 
-    let tree = domTree;
     const path = [];
-    while (nodes.length > 0) {
-        const node = nodes.pop();
-        const index = tree.children.findIndex((tree) => tree.node === node);
-        tree = tree.children[index];
-        path.push(index);
+    while (tree.parent !== null) {
+        const parent = tree.parent;
+        if (parent.dirty) {
+            parent.children.forEach((child, index) => {
+                child.index = index;
+            });
+            parent.dirty = false;
+        }
+        path.push(tree.index);
+        tree = parent;
     }
 
-    return path;
+    if (tree !== domTree) {
+        throw new Error('node not in dom');
+    }
+
+    return path.reverse();
+}
+
+// big subtrees are sent as html and parsed with a template, so they can be
+// parsed in any context (like table rows)
+const template = document.createElement('template');
+
+// clones of subtrees by template id, subtrees with the same shape are sent as
+// [id, ...values] with the attribute values and texts in document order
+const templates = [];
+
+function fillTemplate(node, values, index) {
+    if (node.nodeType === Node.TEXT_NODE) {
+        node.data = values[index];
+        return index + 1;
+    }
+    for (const attr of node.attributes) {
+        attr.value = values[index++];
+    }
+    for (const child of node.childNodes) {
+        index = fillTemplate(child, values, index);
+    }
+    return index;
 }
 
 function createNode(data) {
     if (typeof data === 'string') {
         return document.createTextNode(data);
     }
+    if (typeof data[0] === 'number') {
+        const [id, ...values] = data;
+        const node = templates[id].cloneNode(true);
+        fillTemplate(node, values, 0);
+        return node;
+    }
+    if (data.define !== undefined) {
+        const node = createNode(data.node);
+        templates[data.define] = node.cloneNode(true);
+        return node;
+    }
+    if (!Array.isArray(data)) {
+        template.innerHTML = data.html;
+        const node = template.content.firstChild;
+        template.content.removeChild(node);
+        if (delegateEvents) {
+            delegateNode(node);
+            for (const child of node.querySelectorAll('*')) {
+                delegateNode(child);
+            }
+        }
+        return node;
+    }
     const [tag, props, ...children] = data;
     const node = document.createElement(tag);
     for (const [key, value] of Object.entries(props)) {
         node.setAttribute(key, value);
     }
+    if (delegateEvents) {
+        delegateNode(node);
+    }
     for (const child of children) {
         node.appendChild(createNode(child));
     }
@@ -56,22 +207,151 @@ function createNode(data) {
 
 const socket = new WebSocket({{socket_url}});
 
-async function call(event, preventDefault, stopPropagation) {
+function parseOptions(tokens) {
+    const options = {};
+    for (const token of tokens) {
+        const index = token.indexOf('=');
+        if (index === -1) {
+            options[token] = true;
+        } else {
+            options[token.slice(0, index)] = (
+                token.slice(index + 1).split(',').map(decodeURIComponent)
+            );
+        }
+    }
+    return options;
+}
+
+function accepts(event, options) {
+    return options.keys === undefined || options.keys.includes(event.key);
+}
+
+// debounce and throttle state per node and event type
+const limits = new WeakMap();
+
+function limit(node, type, options, callback) {
+    if (options.debounce === undefined && options.throttle === undefined) {
+        callback();
+        return;
+    }
+
+    let states = limits.get(node);
+    if (states === undefined) {
+        states = {};
+        limits.set(node, states);
+    }
+    let state = states[type];
+    if (state === undefined) {
+        state = { timeout: null, last: -Infinity, callback: null };
+        states[type] = state;
+    }
+
+    if (options.debounce !== undefined) {
+        clearTimeout(state.timeout);
+        state.timeout = setTimeout(callback, Number(options.debounce[0]));
+        return;
+    }
+
+    const wait = state.last + Number(options.throttle[0]) - performance.now();
+    if (wait <= 0 && state.timeout === null) {
+        state.last = performance.now();
+        callback();
+    } else {
+        state.callback = callback;
+        if (state.timeout === null) {
+            state.timeout = setTimeout(() => {
+                state.timeout = null;
+                state.last = performance.now();
+                state.callback();
+            }, wait);
+        }
+    }
+}
+
+function call(event, preventDefault, stopPropagation, handler, options) {
+    options = parseOptions(options ? options.split(' ') : []);
+    if (!accepts(event, options)) {
+        return;
+    }
     if (preventDefault) {
         event.preventDefault();
     }
     if (stopPropagation) {
         event.stopPropagation();
     }
+    const currentTarget = event.currentTarget;
+    if (options.client !== undefined) {
+        runActions(JSON.parse(options.client[0]), currentTarget);
+    }
+    // false means that the callback only consists of client actions
+    if (handler !== false) {
+        limit(currentTarget, event.type, options, () => send(
+            event, currentTarget, handler, options,
+        ));
+    }
+}
+
+// client actions only change attributes, which the mirror does not track so
+// paths stay valid, a later set or unset of the same attribute by the server
+// replaces the change
+function runActions(actions, currentTarget) {
+    for (const [type, selector, ...args] of actions) {
+        const nodes = (
+            selector === null
+            ? [currentTarget]
+            : Array.from(document.querySelectorAll(selector))
+        );
+        if (type === 'focus') {
+            nodes[0]?.focus();
+            continue;
+        }
+        for (const node of nodes) {
+            switch (type) {
+                case 'toggle_class': {
+                    const [name] = args;
+                    node.classList.toggle(name);
+                }; break;
+                case 'set_attribute': {
+                    const [key, value] = args;
+                    if (value === null) {
+                        node.removeAttribute(key);
+                    } else {
+                        node.setAttribute(key, value);
+                    }
+                }; break;
+                case 'show': {
+                    node.hidden = false;
+                }; break;
+                case 'hide': {
+                    node.hidden = true;
+                }; break;
+            }
+        }
+    }
+}
+
+async function send(event, currentTarget, handler, options) {
+    // the server applies the event to the result it sent the actions for, so
+    // these have to be applied before the paths are resolved
+    if (pendingActions.length > 0) {
+        flushActions();
+    }
 
     const details = {};
-    const message = [event.type, ...getPath(event.currentTarget), details];
+    if (handler !== undefined && handler !== null) {
+        details.handler = handler;
+    }
+    const message = [event.type, ...getPath(currentTarget), details];
 
-    if (event.currentTarget !== event.target) {
+    if (currentTarget !== event.target) {
         details.target = getPath(event.target);
     }
 
-    switch (event.type) {
+    if (options.fields !== undefined) {
+        for (const field of options.fields) {
+            details[field] = field in event ? event[field] : event.target[field];
+        }
+    } else switch (event.type) {
         case 'input': case 'change': {
             if (event.target.tagName === 'INPUT' && event.target.getAttribute('type') === 'file') {
                 const files = await Promise.all(
@@ -88,15 +368,151 @@ async function call(event, preventDefault, stopPropagation) {
                 } else {
                     details.file = files[0] ?? null;
                 }
+            } else if (options.delta) {
+                details.delta = valueDelta(event.target);
             } else {
                 details.value = event.target.value;
             }
         }; break;
+        case 'submit': {
+            if (event.target.tagName === 'FORM') {
+                details.values = formValues(event.target);
+            }
+        }; break;
+    }
+
+    if (options.keys !== undefined) {
+        details.key = event.key;
     }
 
     socket.send(JSON.stringify(message));
 }
 
+// the values of the named fields of a form like they would be submitted,
+// fields that occur multiple times have a list of values
+function formValues(form) {
+    const values = {};
+    for (const [name, value] of new FormData(form)) {
+        if (typeof value !== 'string') {
+            continue;
+        }
+        if (!(name in values)) {
+            values[name] = value;
+        } else if (Array.isArray(values[name])) {
+            values[name].push(value);
+        } else {
+            values[name] = [values[name], value];
+        }
+    }
+    return values;
+}
+
+// the last value sent per input for delta encoded events, the first event of
+// an input sends the full value under a key that later deltas refer to
+const inputValues = new WeakMap();
+let nextInputKey = 0;
+
+function valueDelta(node) {
+    const value = node.value;
+    const base = inputValues.get(node);
+    if (base === undefined) {
+        const key = nextInputKey++;
+        inputValues.set(node, { key, value });
+        return [key, value];
+    }
+
+    const max = Math.min(base.value.length, value.length);
+    let start = 0;
+    while (start < max && base.value[start] === value[start]) {
+        start++;
+    }
+    let end = 0;
+    while (
+        end < max - start &&
+        base.value[base.value.length - 1 - end] === value[value.length - 1 - end]
+    ) {
+        end++;
+    }
+
+    const delta = [
+        base.key, start, base.value.length - start - end,
+        value.slice(start, value.length - end),
+    ];
+    base.value = value;
+    return delta;
+}
+
+// in delegated mode handlers are data-on<type> attributes with the handler id
+// (or - if there are only client actions) and its options, listeners on the
+// document handle all events of a type
+const delegated = new Set();
+
+function delegateNode(node) {
+    for (const name of node.getAttributeNames()) {
+        if (name.startsWith('data-on')) {
+            delegate(name.slice('data-on'.length));
+        }
+    }
+}
+
+function delegate(type) {
+    if (delegated.has(type)) {
+        return;
+    }
+    delegated.add(type);
+
+    // events that bubble are handled once they reach the document, so like
+    // with inline handlers listeners below can still stop them, events that
+    // do not bubble only reach the document while it captures them
+    document.addEventListener(type, (event) => {
+        if (event.bubbles) {
+            handleDelegated(type, event);
+        }
+    });
+    document.addEventListener(type, (event) => {
+        if (!event.bubbles) {
+            handleDelegated(type, event);
+        }
+    }, true);
+}
+
+function handleDelegated(type, event) {
+    let node = event.target;
+    while (node !== null && node !== document) {
+        const value = (
+            node.nodeType === Node.ELEMENT_NODE
+            ? node.getAttribute(`data-on${type}`)
+            : null
+        );
+        if (value !== null) {
+            const [handler, ...tokens] = value.split(' ');
+            const options = parseOptions(tokens);
+            if (accepts(event, options)) {
+                if (options.p) {
+                    event.preventDefault();
+                }
+                const currentTarget = node;
+                if (options.client !== undefined) {
+                    runActions(JSON.parse(options.client[0]), currentTarget);
+                }
+                if (handler !== '-') {
+                    limit(currentTarget, type, options, () => send(
+                        event, currentTarget, Number(handler), options,
+                    ));
+                }
+                if (options.s) {
+                    event.stopPropagation();
+                    break;
+                }
+            }
+        }
+        if (!event.bubbles) {
+            break;
+        }
+        node = node.parentNode;
+    }
+}
+
 addEventListener('popstate', (event) => {
     socket.send(JSON.stringify(['pop_url', event.state.url]));
 });
@@ -107,26 +523,34 @@ function handleAction([action, ...path]) {
             const node = createNode(path.pop());
             const index = path.pop();
             const parent = getTree(path);
-            if (index === parent.children.length) {
+            // the children have to be mirrored before the dom changes
+            const children = getChildren(parent);
+            if (index === children.length) {
                 parent.node.appendChild(node);
-                parent.children.push(createTree(node));
             } else {
-                parent.node.insertBefore(node, parent.children[index].node);
-                parent.children.splice(index, 0, createTree(node));
+                parent.node.insertBefore(node, children[index].node);
             }
+            insertTree(parent, index, node);
         }; break;
         case 'remove': {
             const index = path.pop();
             const parent = getTree(path);
-            parent.node.removeChild(parent.children[index].node);
-            parent.children.splice(index, 1);
+            const children = getChildren(parent);
+            forgetTree(children[index]);
+            parent.node.removeChild(children[index].node);
+            children.splice(index, 1);
+            if (index !== children.length) {
+                parent.dirty = true;
+            }
         }; break;
         case 'replace': {
             const node = createNode(path.pop());
             const index = path.pop();
             const parent = getTree(path);
-            parent.node.replaceChild(node, parent.children[index].node);
-            parent.children[index] = createTree(node);
+            const children = getChildren(parent);
+            forgetTree(children[index]);
+            parent.node.replaceChild(node, children[index].node);
+            children[index] = createTree(node, parent, index);
         }; break;
         case 'move': {
             let newIndex = path.pop();
@@ -135,20 +559,29 @@ function handleAction([action, ...path]) {
             if (oldIndex === newIndex) {
                 break;
             }
-            const [tree] = parent.children.splice(oldIndex, 1);
-            if (newIndex === parent.children.length) {
+            const children = getChildren(parent);
+            const [tree] = children.splice(oldIndex, 1);
+            if (newIndex === children.length) {
                 parent.node.appendChild(tree.node);
             } else {
-                parent.node.insertBefore(tree.node, parent.children[newIndex].node);
+                parent.node.insertBefore(tree.node, children[newIndex].node);
             }
-            parent.children.splice(newIndex, 0, tree);
+            children.splice(newIndex, 0, tree);
+            parent.dirty = true;
         }; break;
         case 'set': {
             const value = path.pop();
             const key = path.pop();
             const node = getNode(path);
+            if (delegateEvents && key.startsWith('data-on')) {
+                delegate(key.slice('data-on'.length));
+            }
             if (key === 'value') {
-                node.value = value;
+                // assigning the value the input already has would still reset
+                // the caret
+                if (node.value !== String(value)) {
+                    node.value = value;
+                }
             } else {
                 node.setAttribute(key, value);
             }
@@ -181,20 +614,58 @@ function handleAction([action, ...path]) {
     }
 }
 
-window.addEventListener('load', () => {
-    domTree = createTree(document);
-    for (const action of pendingActions) {
+function flushActions() {
+    flushScheduled = false;
+    // actions that come in before the page has loaded wait for the load event,
+    // until then scripts that are streamed in can still apply actions that
+    // come before them
+    if (!loaded) {
+        return;
+    }
+    const actions = pendingActions;
+    pendingActions = [];
+    for (const action of actions) {
         handleAction(action);
     }
-    pendingActions = null;
+}
+
+function handleStream(actions) {
+    // called by scripts that are streamed in after the initial html, these are
+    // not part of the result so they remove themselves before doing anything
+    document.currentScript.remove();
+    if (domTree === null) {
+        initTree();
+    }
+    for (const action of actions) {
+        handleAction(action);
+    }
+}
+
+window.addEventListener('load', () => {
+    if (domTree === null) {
+        initTree();
+    }
+    loaded = true;
+    flushActions();
+});
+
+// animation frames do not fire in hidden tabs, so there the actions are
+// applied right away instead of piling up until the tab is shown again
+document.addEventListener('visibilitychange', () => {
+    if (document.hidden && pendingActions.length > 0) {
+        flushActions();
+    }
 });
 
 socket.addEventListener('message', function (event) {
+    // all actions that come in before the next frame are applied at once
     for (const action of JSON.parse(event.data)) {
-        if (domTree === null) {
-            pendingActions.push(action);
-        } else {
-            handleAction(action);
-        }
+        pendingActions.push(action);
+    }
+    if (document.hidden) {
+        flushActions();
+    } else if (!flushScheduled) {
+        flushScheduled = true;
+        requestAnimationFrame(flushActions);
     }
 });
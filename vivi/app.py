@@ -1,30 +1,67 @@
 import asyncio
 from base64 import b64decode
 from contextlib import AsyncExitStack, asynccontextmanager
-from itertools import islice
 import json
 from pathlib import Path
+import re
+from time import monotonic
 from types import SimpleNamespace
 from urllib.parse import unquote_to_bytes
 from uuid import uuid4
+from weakref import WeakSet
 
 from starlette.applications import Starlette
 from starlette.routing import Route, WebSocketRoute, Mount
 from starlette.staticfiles import StaticFiles
-from starlette.responses import Response, FileResponse
+from starlette.responses import Response, StreamingResponse, FileResponse
 from starlette.websockets import WebSocketDisconnect
 
-from .hooks import CONTEXT, _url_provider, _shared_pubsub
-from .html import SafeText, html_parts, html_diff, html_refs
+from .events import Handlers, ClientActions, apply_delta
+from .hooks import CONTEXT, TRANSITION, _url_provider, _shared_pubsub
+from .html import (
+    SafeText, HTMLNode, IDENTITY, NO_MAPPING,
+    ReportedValues, html_parts, html_diff, html_refs, html_rebase, html_get,
+    Templates, html_payloads,
+)
 from .paths import Paths
-from .node import Node
+from .ids import NodeIds
+from .node import Node, remap_nodes
 
 
 DOCTYPE = SafeText('<!doctype html>')
-SCRIPT_BEFORE, SCRIPT_AFTER = (
-    Path(__file__).parent.joinpath('app.js')
-    .read_text().split('{{socket_url}}')
+TRANSITION_BUDGET = 0.01
+SCRIPT_START, SCRIPT_BEFORE, SCRIPT_AFTER = re.split(
+    r'\{\{(?:config|socket_url)\}\}',
+    Path(__file__).parent.joinpath('app.js').read_text(),
 )
+STREAM_BEFORE = '<script>handleStream('
+STREAM_AFTER = ');</script>'
+
+
+class Event(SimpleNamespace):
+
+    # the target nodes are resolved when they are first used, since the paths
+    # they are resolved from are only valid until the next render any events
+    # that are still around are resolved before that
+    def __init__(self, resolve_targets, **details):
+        super().__init__(**details)
+        self._resolve_targets = resolve_targets
+
+    __hash__ = object.__hash__
+
+    def _resolve(self):
+        resolve_targets = self.__dict__.pop('_resolve_targets', None)
+        if resolve_targets is not None:
+            self.target, self.current_target = resolve_targets()
+
+    def __getattr__(self, name):
+        if (
+            name in ('target', 'current_target') and
+            '_resolve_targets' in self.__dict__
+        ):
+            self._resolve()
+            return getattr(self, name)
+        raise AttributeError(name)
 
 
 def parse_data_url(data_url):
@@ -47,16 +84,22 @@ def parse_data_url(data_url):
 
 
 def wrap(result, script=None, prev_head=None):
-    while isinstance(result, tuple) and result[0] is None and len(result) == 4:
-        result = result[3]
+    while (
+        isinstance(result, HTMLNode) and
+        result.tag is None and
+        len(result.children) == 1
+    ):
+        result = result.children[0]
 
-    if not isinstance(result, tuple) or result[0] != 'html':
-        result = ('html', {}, {0: 0}, ('body', {}, {0: 0}, result))
+    if not isinstance(result, HTMLNode) or result.tag != 'html':
+        result = HTMLNode('html', {}, IDENTITY, (
+            HTMLNode('body', {}, IDENTITY, (result,)),
+        ))
 
     head = None
     body = None
 
-    stack = [islice(result, 3, None)]
+    stack = [iter(result.children)]
     while stack:
         try:
             node = next(stack[-1])
@@ -64,12 +107,12 @@ def wrap(result, script=None, prev_head=None):
             stack.pop()
             continue
 
-        if isinstance(node, tuple) and node[0] is None:
-            stack.append(islice(result, 3, None))
-        elif isinstance(node, tuple) and node[0] == 'head':
+        if isinstance(node, HTMLNode) and node.tag is None:
+            stack.append(iter(node.children))
+        elif isinstance(node, HTMLNode) and node.tag == 'head':
             assert head is None
             head = node
-        elif isinstance(node, tuple) and node[0] == 'body':
+        elif isinstance(node, HTMLNode) and node.tag == 'body':
             assert body is None
             body = node
         else:
@@ -79,26 +122,26 @@ def wrap(result, script=None, prev_head=None):
 
     if script is not None:
         if head is None:
-            head = ('head', {}, {0: 0}, script)
+            head = HTMLNode('head', {}, IDENTITY, (script,))
         else:
-            _, props, mapping, *children = head
-            if head is prev_head:
-                mapping = {i: i for i in range(len(children))}
-            new_mapping = {0: 0}
-            for index, prev_index in mapping.items():
-                new_mapping[index + 1] = prev_index + 1
-            head = ('head', {}, new_mapping, script, *children)
+            mapping = head.mapping
+            if head is prev_head or mapping is IDENTITY:
+                new_mapping = IDENTITY
+            else:
+                new_mapping = {0: 0}
+                for index, prev_index in mapping.items():
+                    new_mapping[index + 1] = prev_index + 1
+            head = HTMLNode('head', {}, new_mapping, (script, *head.children))
 
     if head is None:
-        head = ('head', {}, {})
+        head = HTMLNode('head', {}, NO_MAPPING, ())
     if body is None:
-        body = ('body', {}, {})
+        body = HTMLNode('body', {}, NO_MAPPING, ())
 
-    result = (
-        None, {}, {0: 0, 1: 1},
+    result = HTMLNode(None, {}, IDENTITY, (
         DOCTYPE,
-        ('html', result[1], {0: 0, 1: 1}, head, body),
-    )
+        HTMLNode('html', result.props, IDENTITY, (head, body)),
+    ))
     return result, original_head
 
 
@@ -110,9 +153,18 @@ def mount(
     eager=None,
 ):
     contexts = {}
+    # paths of async components that are still loading and paths of the
+    # children of suspense boundaries
+    suspense = (Paths(), Paths())
 
     def rerender_path(path):
-        queue.put_nowait(('path', path))
+        if TRANSITION.get():
+            queue.put_nowait(('transition_path', path))
+        else:
+            queue.put_nowait(('path', path))
+
+    def end_transition(callback):
+        queue.put_nowait(('transition_end', callback))
 
     def push_url(url):
         queue.put_nowait(('push_url', url))
@@ -128,19 +180,39 @@ def mount(
 
     elem_with_url = _url_provider(elem, value=url)
     state, result = elem_with_url._init()
+    base_result = None
+    # while a transition is rendered in passes this is the last committed
+    # render, a render that is not part of the transition drops the work of
+    # the transition and continues from here so it never shows half of it,
+    # the side effects of the transition wait in commits until it is done
+    committed = None
+    commits = []
+
+    def rerender(
+        url, paths, eager=None, deadline=None, deferred=None,
+        transition=False,
+    ):
+        nonlocal elem_with_url, state, result, base_result, committed
 
-    def rerender(url, paths, eager=None):
-        nonlocal elem_with_url, state, result
+        if transition:
+            if committed is None:
+                committed = (elem_with_url, state, result, base_result)
+        elif committed is not None:
+            elem_with_url, state, result, base_result = committed
+            committed = None
+            commits.clear()
 
         elem_with_url = _url_provider(elem, value=url)
 
         token = CONTEXT.set(SimpleNamespace(
             rerender_path=rerender_path,
+            end_transition=end_transition,
             push_url=push_url,
             replace_url=replace_url,
             set_cookie=set_cookie,
             unset_cookie=unset_cookie,
             contexts=contexts,
+            suspense=suspense,
             cookies=cookies,
             cookie_paths=cookie_paths,
             rerender_paths=paths,
@@ -149,16 +221,45 @@ def mount(
             shared=shared,
             get_url=get_url,
             eager=eager,
+            deadline=deadline,
+            deferred=deferred,
+            rendered=False,
+            render_id=object(),
+            transition=transition,
+            commits=commits if transition else None,
         ))
+        prev_result = result
         try:
             state, result = elem_with_url._render(state, result)
         finally:
             CONTEXT.reset(token)
 
+        # when the previous render deferred work the result it returned was
+        # never diffed, so we keep the mappings relative to the last result
+        # that was returned without deferring anything
+        if base_result is not None:
+            result = html_rebase(base_result, prev_result, result)
+        if deferred:
+            if base_result is None:
+                base_result = prev_result
+        else:
+            base_result = None
+
+        if transition and not deferred:
+            committed = None
+            callbacks = commits.copy()
+            commits.clear()
+            for callback in callbacks:
+                callback()
+
         return result
 
     def unmount():
-        nonlocal elem_with_url, state, result
+        nonlocal elem_with_url, state, result, committed
+        if committed is not None:
+            elem_with_url, state, result, _ = committed
+            committed = None
+            commits.clear()
         elem_with_url._unmount(state, result)
 
     result = rerender(url, Paths(), eager)
@@ -174,6 +275,11 @@ class Vivi:
         static_route='/static',
         file_route='/file/{file_id:uuid}',
         shared=[],
+        render_budget=None,
+        eager_timeout=None,
+        stream_timeout=5,
+        node_ids=False,
+        delegate_events=False,
     ):
         routes = []
 
@@ -213,7 +319,13 @@ class Vivi:
         self._client_files = {}
         self._client_sessions = {}
         self._sessions = {}
+        self._streams = {}
         self._shared = [_shared_pubsub, *shared]
+        self._render_budget = render_budget
+        self._eager_timeout = eager_timeout
+        self._stream_timeout = stream_timeout
+        self._node_ids = node_ids
+        self._delegate_events = delegate_events
 
     async def __call__(self, scope, receive, send):
         await self._base_app(scope, receive, send)
@@ -250,19 +362,22 @@ class Vivi:
             eager=eager,
         )
 
-        async def next_render(eager=None):
-            nonlocal url
+        transition_paths = Paths()
+        transition_ends = []
 
-            changes = [await queue.get()]
-            while not queue.empty():
-                changes.append(queue.get_nowait())
+        def process_changes(changes, actions, paths):
+            nonlocal url
 
-            actions = []
-            paths = Paths()
             for change in changes:
                 if change[0] == 'path':
                     _, path = change
                     paths[path] = None
+                elif change[0] == 'transition_path':
+                    _, path = change
+                    transition_paths[path] = None
+                elif change[0] == 'transition_end':
+                    _, callback = change
+                    transition_ends.append(callback)
                 elif change[0] in ('pop_url', 'push_url', 'replace_url'):
                     change_type, url = change
                     if change_type != 'pop_url':
@@ -282,22 +397,133 @@ class Vivi:
                 else:
                     actions.append(change)
 
-            return actions, rerender(url, paths, eager)
+        def take_changes():
+            changes = []
+            while not queue.empty():
+                changes.append(queue.get_nowait())
+            return changes
+
+        async def render(paths, actions, eager):
+            if self._render_budget is None:
+                return rerender(url, paths, eager)
+
+            # render in passes of at most the render budget, in between we
+            # yield to the event loop and pick up changes that came in, only
+            # the final result is returned so changes are applied atomically
+            while True:
+                deferred = Paths()
+                result = rerender(
+                    url, paths, eager,
+                    monotonic() + self._render_budget, deferred,
+                )
+                if not deferred:
+                    return result
+
+                await asyncio.sleep(0)
+
+                paths = deferred
+                process_changes(take_changes(), actions, paths)
+
+        async def render_transition(actions, paths, eager):
+            nonlocal transition_paths
+
+            budget = self._render_budget
+            if budget is None:
+                budget = TRANSITION_BUDGET
+
+            # the paths of the whole transition, when it gets interrupted all
+            # of them are rendered again from the last committed result
+            all_paths = Paths()
+            all_paths.update(transition_paths)
+            transition_paths, low_paths = Paths(), transition_paths
+            while True:
+                deferred = Paths()
+                result = rerender(
+                    url, low_paths, eager,
+                    monotonic() + budget, deferred,
+                    transition=True,
+                )
+                if not deferred:
+                    return result
+
+                await asyncio.sleep(0)
+
+                process_changes(take_changes(), actions, paths)
+                # changes with a higher priority came in, what we have
+                # rendered so far is dropped by the next render and the
+                # transition starts over once these changes are rendered
+                if paths or actions:
+                    transition_paths.update(all_paths)
+                    return None
+
+                low_paths = deferred
+                low_paths.update(transition_paths)
+                all_paths.update(transition_paths)
+                transition_paths = Paths()
+
+        async def next_render(eager=None):
+            actions = []
+            paths = Paths()
 
+            while not paths and not actions:
+                if queue.empty() and transition_paths:
+                    result = await render_transition(actions, paths, eager)
+                    if result is not None:
+                        return actions, result
+                elif queue.empty() and transition_ends:
+                    for callback in transition_ends:
+                        callback()
+                    transition_ends.clear()
+                else:
+                    changes = [await queue.get(), *take_changes()]
+                    process_changes(changes, actions, paths)
+
+            return actions, await render(paths, actions, eager)
+
+        if self._eager_timeout is None:
+            deadline = None
+        else:
+            deadline = monotonic() + self._eager_timeout
+
+        # we wait on all eager futures at once so they resolve concurrently
+        # and the ones that resolve together only need a single render, what
+        # has not resolved before the deadline is sent over the websocket
         init_actions = []
         while eager:
-            actions, result = await next_render(eager)
-            init_actions.extend(actions)
+            if deadline is None:
+                timeout = None
+            else:
+                timeout = max(deadline - monotonic(), 0)
+
+            await asyncio.wait(eager, timeout=timeout)
+            if not queue.empty():
+                actions, result = await next_render(eager)
+                init_actions.extend(actions)
+
+            if deadline is not None and monotonic() >= deadline:
+                break
 
         session_id = uuid4()
-        script = ('script', {}, {0: 0}, SafeText(
+        script = HTMLNode('script', {}, IDENTITY, (SafeText(
+            SCRIPT_START +
+            json.dumps({
+                'nodeIds': self._node_ids,
+                'delegateEvents': self._delegate_events,
+            }) +
             SCRIPT_BEFORE +
             json.dumps(request.url_for('websocket', session_id=session_id)) +
             SCRIPT_AFTER
-        ))
+        ),))
         base_result = result
         result, head = wrap(result, script)
 
+        if self._node_ids:
+            node_ids = NodeIds(result)
+        else:
+            node_ids = None
+        handlers = Handlers(delegate=self._delegate_events)
+        templates = Templates()
+
         self._client_sessions[client_id] += 1
 
         def full_unmount():
@@ -307,17 +533,6 @@ class Vivi:
                 del self._client_sessions[client_id]
                 del self._client_files[client_id]
 
-        self._sessions[session_id] = (
-            queue,
-            subscriptions,
-            script,
-            head,
-            base_result,
-            init_actions,
-            next_render,
-            full_unmount,
-        )
-
         def session_timeout():
             try:
                 del self._sessions[session_id]
@@ -325,15 +540,98 @@ class Vivi:
                 return
             full_unmount()
 
-        loop = asyncio.get_running_loop()
-        loop.call_later(5, session_timeout)
-        html_refs(None, result, queue, subscriptions)
+        def start_session():
+            self._sessions[session_id] = (
+                queue,
+                subscriptions,
+                script,
+                head,
+                base_result,
+                init_actions,
+                next_render,
+                full_unmount,
+                node_ids,
+                handlers,
+                templates,
+            )
 
-        response = Response(
-            ''.join(html_parts(result)),
-            media_type='text/html',
-            headers={'connection': 'keep-alive'},
-        )
+            loop = asyncio.get_running_loop()
+            loop.call_later(5, session_timeout)
+            html_refs(None, result, queue, subscriptions)
+
+        async def stream():
+            nonlocal base_result, result, head
+
+            try:
+                yield ''.join(html_parts(result, handlers))
+
+                if self._stream_timeout is None:
+                    stream_deadline = None
+                else:
+                    stream_deadline = monotonic() + self._stream_timeout
+
+                # the eager futures that did not resolve before the deadline
+                # are streamed in as they resolve, every chunk is a script that
+                # applies the diff, so the document stays in sync with result,
+                # once the websocket connects or the stream timeout passes the
+                # websocket takes over and picks up what is still loading
+                while eager and not takeover.done():
+                    if stream_deadline is None:
+                        timeout = None
+                    else:
+                        timeout = stream_deadline - monotonic()
+                        if timeout <= 0:
+                            break
+
+                    done, _ = await asyncio.wait(
+                        [*eager, takeover],
+                        timeout=timeout,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    if not done or takeover.done():
+                        continue
+
+                    old_result = result
+                    actions, base_result = await next_render(eager)
+                    result, head = wrap(base_result, script, head)
+
+                    actions.extend(html_diff(
+                        old_result, result, handlers=handlers,
+                    ))
+                    if node_ids is not None:
+                        actions = node_ids.translate(actions)
+                    actions = list(html_payloads(actions, templates))
+                    if node_ids is not None:
+                        node_ids.update(result)
+                    if actions:
+                        yield (
+                            STREAM_BEFORE +
+                            json.dumps(actions, separators=(',', ':'))
+                            .replace('<', '\\u003c') +
+                            STREAM_AFTER
+                        )
+            finally:
+                start_session()
+                del self._streams[session_id]
+                ended.set_result(None)
+
+        if eager:
+            loop = asyncio.get_running_loop()
+            takeover = loop.create_future()
+            ended = loop.create_future()
+            self._streams[session_id] = takeover, ended
+            response = StreamingResponse(
+                stream(),
+                media_type='text/html',
+                headers={'connection': 'keep-alive'},
+            )
+        else:
+            start_session()
+            response = Response(
+                ''.join(html_parts(result, handlers)),
+                media_type='text/html',
+                headers={'connection': 'keep-alive'},
+            )
         if self._client_sessions[client_id] == 1:
             response.set_cookie('vivi_client', client_id)
         return response
@@ -341,6 +639,17 @@ class Vivi:
     async def _websocket(self, socket):
         loop = asyncio.get_running_loop()
         session_id = socket.path_params['session_id']
+        # while the initial response is still streaming the session does not
+        # exist yet, so we tell the stream to stop after its current render
+        # and wait for that, what is still loading is then sent from here
+        try:
+            takeover, ended = self._streams[session_id]
+        except KeyError:
+            pass
+        else:
+            if not takeover.done():
+                takeover.set_result(None)
+            await ended
         try:
             (
                 queue,
@@ -351,6 +660,9 @@ class Vivi:
                 init_actions,
                 next_render,
                 unmount,
+                node_ids,
+                handlers,
+                templates,
             ) = self._sessions.pop(session_id)
         except KeyError:
             await socket.close()
@@ -358,6 +670,8 @@ class Vivi:
 
         await socket.accept()
 
+        if node_ids is not None:
+            init_actions = list(node_ids.translate(init_actions))
         if init_actions:
             await socket.send_text(json.dumps(
                 init_actions,
@@ -366,6 +680,15 @@ class Vivi:
 
         receive_fut = asyncio.create_task(socket.receive_json())
         render_fut = asyncio.create_task(next_render())
+        unresolved_events = WeakSet()
+        # the last value the client reported per input, so the diff does not
+        # echo it back
+        values = ReportedValues()
+        # the last value the client sent for delta encoded events by the key
+        # the client chose for the input, along with the subscribed node and
+        # tag of the input so the value can be dropped once it is no longer
+        # rendered
+        input_values = {}
 
         while True:
             await asyncio.wait(
@@ -384,20 +707,55 @@ class Vivi:
                 if event_type == 'pop_url':
                     assert not path
                     queue.put_nowait(('pop_url', details))
+                elif node_ids is not None and any(
+                    node_id not in node_ids
+                    for node_id in (*path, *details.get('target', ()))
+                ):
+                    # the node is no longer rendered, so just like with a
+                    # handler that is no longer rendered the event is ignored
+                    pass
+                elif (
+                    len(details.get('delta', ())) > 2 and
+                    details['delta'][0] not in input_values
+                ):
+                    # the input of the edit is no longer rendered, without the
+                    # value it is relative to the event is ignored as well
+                    pass
                 else:
-                    wrapped_result, _ = wrap(result, script, head)
-
-                    current_target = Node.from_path(
-                        wrapped_result, path, queue, subscriptions,
-                    )
-                    try:
-                        target_path = details.pop('target')
-                    except KeyError:
-                        target = current_target
-                    else:
-                        target = Node.from_path(
-                            wrapped_result, target_path, queue, subscriptions,
+                    target_path = details.pop('target', None)
+                    handler_id = details.pop('handler', None)
+
+                    def resolve_targets(
+                        result=result, head=head,
+                        path=path, target_path=target_path,
+                    ):
+                        # in node ids mode the paths are just the id of the
+                        # node instead, which refers to the node directly
+                        if node_ids is not None:
+                            current_target = Node(
+                                *node_ids.get(*path), queue, subscriptions,
+                            )
+                            if target_path is None:
+                                target = current_target
+                            else:
+                                target = Node(
+                                    *node_ids.get(*target_path),
+                                    queue, subscriptions,
+                                )
+                            return target, current_target
+
+                        wrapped_result, _ = wrap(result, script, head)
+                        current_target = Node.from_path(
+                            wrapped_result, path, queue, subscriptions,
                         )
+                        if target_path is None:
+                            target = current_target
+                        else:
+                            target = Node.from_path(
+                                wrapped_result, target_path,
+                                queue, subscriptions,
+                            )
+                        return target, current_target
 
                     if 'file' in details:
                         details['file'] = parse_data_url(details['file'])
@@ -406,27 +764,89 @@ class Vivi:
                             parse_data_url(data_url)
                             for data_url in details['files']
                         ]
-
-                    handler = current_target[f'on{event_type}']
-                    loop.call_soon(handler, SimpleNamespace(
-                        type=event_type,
-                        target=target,
-                        current_target=current_target,
-                        **details,
-                    ))
+                    if 'delta' in details:
+                        key, *delta = details.pop('delta')
+                        if len(delta) == 1:
+                            value, = delta
+                            input_node, _ = resolve_targets()
+                            tag = input_node.tag
+                        else:
+                            input_node, tag, value = input_values[key]
+                            value = apply_delta(value, *delta)
+                        input_values[key] = (input_node, tag, value)
+                        details['value'] = value
+                    if 'value' in details:
+                        input_path = (
+                            path if target_path is None else target_path
+                        )
+                        if node_ids is not None:
+                            _, node = node_ids.get(*input_path)
+                        else:
+                            node, _ = wrap(result, script, head)
+                            try:
+                                for index in input_path:
+                                    node = html_get(node, index)
+                            except (AttributeError, IndexError):
+                                node = None
+                        if isinstance(node, HTMLNode):
+                            values[node] = details['value']
+
+                    event = Event(resolve_targets, type=event_type, **details)
+                    if handler_id is None:
+                        handler = event.current_target[f'on{event_type}']
+                    else:
+                        try:
+                            handler = handlers[handler_id]
+                        except KeyError:
+                            # the node of the handler is no longer rendered,
+                            # the callback that is rendered at its path now
+                            # gets the event instead
+                            try:
+                                handler = (
+                                    event.current_target[f'on{event_type}']
+                                )
+                            except (KeyError, IndexError, ValueError):
+                                handler = None
+                            if isinstance(handler, ClientActions):
+                                handler = None
+                        else:
+                            unresolved_events.add(event)
+
+                    if handler is not None:
+                        loop.call_soon(handler, event)
 
                 receive_fut = asyncio.create_task(socket.receive_json())
 
             elif render_fut.done():
+                for event in list(unresolved_events):
+                    event._resolve()
+                unresolved_events.clear()
+
                 old_result, _ = wrap(result, script)
                 actions, result = render_fut.result()
                 new_result, head = wrap(result, script, head)
 
-                for callback in list(subscriptions):
-                    callback(new_result)
+                remap_nodes(subscriptions, new_result)
                 html_refs(old_result, new_result, queue, subscriptions)
-
-                actions.extend(html_diff(old_result, new_result))
+                # the values of inputs that are no longer rendered are dropped,
+                # an input replaced by another element counts as well as the
+                # client replaces it with a new element
+                for key, (input_node, tag, _) in list(input_values.items()):
+                    if (
+                        input_node._subscription is None or
+                        input_node.type != 'element' or
+                        input_node.tag != tag
+                    ):
+                        del input_values[key]
+
+                actions.extend(html_diff(
+                    old_result, new_result, handlers=handlers, values=values,
+                ))
+                if node_ids is not None:
+                    actions = node_ids.translate(actions)
+                actions = list(html_payloads(actions, templates))
+                if node_ids is not None:
+                    node_ids.update(new_result)
                 if actions:
                     await socket.send_text(json.dumps(
                         actions,
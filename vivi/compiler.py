@@ -0,0 +1,521 @@
+import ast
+from functools import update_wrapper
+import inspect
+import operator
+import textwrap
+from types import CellType, CodeType, FunctionType
+
+from .elements import (
+    Element, HTMLElement, HTMLFactory, Component, NONE, INCOMPATIBLE,
+    COMPATIBLE, EQUIVALENT, hash_value, resolve_signals, bind_signals,
+    unbind_signals,
+)
+from .html import SafeText, HTMLNode, IDENTITY, NO_MAPPING
+
+
+TEMPLATES = '__vivi_templates__'
+NO_KEY = object()
+
+
+class TemplateNode:
+
+    __slots__ = ['tag', 'props', 'children', 'node']
+
+    def __init__(self, tag, props, children):
+        self.tag = tag
+        self.children = children
+
+        if all(isinstance(op, dict) for op in props):
+            self.props = {}
+            for op in props:
+                self.props.update(op)
+        else:
+            self.props = props
+
+        if isinstance(self.props, dict) and all(
+            not isinstance(child, (TemplateNode, int)) or
+            isinstance(child, TemplateNode) and child.node is not None
+            for child in children
+        ):
+            self.node = HTMLNode(tag, self.props, NO_MAPPING, tuple(
+                child.node if isinstance(child, TemplateNode) else child
+                for child in children
+            ))
+        else:
+            self.node = None
+
+    def get_props(self, values):
+        if isinstance(self.props, dict):
+            return self.props
+
+        props = {}
+        for op in self.props:
+            if isinstance(op, dict):
+                props.update(op)
+            elif isinstance(op, tuple):
+                name, hole = op
+                props[name] = values[hole]
+            elif isinstance(values[op], dict):
+                props.update(values[op])
+
+        props.pop('key', None)
+        if 'children' in props:
+            raise ValueError('\'children\' is not allowed as a property name')
+        if self.tag is None and props:
+            raise ValueError('fragment cannot have props')
+        return props
+
+    def get_element(self, values):
+        children = []
+        for child in self.children:
+            if isinstance(child, TemplateNode):
+                children.append(child.get_element(values))
+            elif isinstance(child, int):
+                if not isinstance(values[child], dict):
+                    children.append(values[child])
+            else:
+                children.append(child)
+        return HTMLElement(
+            self.tag, dict(self.get_props(values)), tuple(children),
+        )
+
+
+class Template:
+
+    def __init__(self, root, key=NO_KEY):
+        self._root = root
+        self._key = key
+        self._paths = {}
+
+        stack = [(root, ())]
+        while stack:
+            node, path = stack.pop()
+            for index, child in enumerate(node.children):
+                if isinstance(child, TemplateNode):
+                    stack.append((child, (*path, index)))
+                elif isinstance(child, int):
+                    self._paths[child] = (*path, index)
+
+    def __call__(self, *values):
+        return TemplateElement(self, values)
+
+    def get(self, result, hole):
+        for index in self._paths[hole]:
+            result = result.children[index]
+        return result
+
+    def replace(self, result, hole, child_result):
+        return self._replace(result, self._paths[hole], child_result)
+
+    def _replace(self, node, path, child_result):
+        index, *path = path
+        children = node.children
+        if path:
+            child_result = self._replace(children[index], path, child_result)
+        if child_result is children[index]:
+            return node
+        return HTMLNode(
+            node.tag, node.props, IDENTITY,
+            (*children[:index], child_result, *children[index + 1:]),
+        )
+
+
+class TemplateElement(Element):
+
+    __slots__ = ['_template', '_values']
+
+    def __init__(self, template, values):
+        self._template = template
+        self._values = values
+        if template._key is not NO_KEY:
+            self._key = template._key
+
+    def _element(self):
+        elem = self._template._root.get_element(self._values)
+        if self._template._key is not NO_KEY:
+            elem._key = self._template._key
+        return elem
+
+    def __call__(self, *args, **kwargs):
+        return self._element()(*args, **kwargs)
+
+    def _copy(self, props, children):
+        raise ValueError('templates cannot be copied')
+
+    def __eq__(self, other):
+        return other is self or (
+            isinstance(other, TemplateElement) and
+            other._template is self._template and
+            hash(other) == hash(self) and
+            other._values == self._values
+        )
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash((
+                TemplateElement, self._template, hash_value(self._values),
+            ))
+            return self._hash
+
+    def _comp(self, elem):
+        if (
+            not isinstance(elem, TemplateElement) or
+            elem._template is not self._template
+        ):
+            return INCOMPATIBLE
+        elif elem == self:
+            return EQUIVALENT
+        else:
+            return COMPATIBLE
+
+    def _init(self):
+        return ({}, None), None
+
+    def _render(self, prev_state, prev_result):
+        state = {}
+        prev_state, prev_signals = prev_state
+        prev_state = prev_state.copy()
+        signals = set()
+
+        result = self._render_node(
+            self._template._root, prev_result, state, prev_state, signals,
+        )
+        signals = bind_signals(signals, prev_signals)
+
+        for hole, prev_child, prev_child_state in prev_state.values():
+            if isinstance(prev_child, Element):
+                prev_child_result = self._template.get(prev_result, hole)
+                prev_child._unmount(prev_child_state, prev_child_result)
+
+        return (state, signals), result
+
+    def _render_node(self, node, prev_node, state, prev_state, signals):
+        if node.node is not None:
+            return node.node
+
+        child_results = []
+        child_prev_indexes = {}
+
+        for index, child in enumerate(node.children):
+            if prev_node is None:
+                prev_child_result = None
+            else:
+                prev_child_result = prev_node.children[index]
+
+            if isinstance(child, TemplateNode):
+                child_result = self._render_node(
+                    child, prev_child_result, state, prev_state, signals,
+                )
+            elif isinstance(child, int):
+                child_result, matched = self._render_hole(
+                    child, prev_child_result, state, prev_state,
+                )
+                if not matched:
+                    child_results.append(child_result)
+                    continue
+            else:
+                child_result = child
+
+            child_prev_indexes[index] = index
+            child_results.append(child_result)
+
+        props = resolve_signals(node.get_props(self._values), signals)
+
+        if prev_node is None:
+            mapping = NO_MAPPING
+        elif len(child_prev_indexes) == len(child_results):
+            if (
+                all(map(operator.is_, child_results, prev_node.children)) and
+                (props is prev_node.props or props == prev_node.props)
+            ):
+                return prev_node
+            mapping = IDENTITY
+        else:
+            mapping = child_prev_indexes
+
+        return HTMLNode(node.tag, props, mapping, tuple(child_results))
+
+    def _render_hole(self, hole, prev_child_result, state, prev_state):
+        child = self._values[hole]
+        if isinstance(child, dict) or child is False:
+            child = None
+
+        if child is None or isinstance(child, (str, SafeText)):
+            key = hole
+        else:
+            child = self._clean_elem(child)
+            try:
+                key = (hole, child._key)
+            except AttributeError:
+                key = hole
+
+        try:
+            _, prev_child, prev_child_state = prev_state.pop(key)
+        except KeyError:
+            prev_child = NONE
+            prev_child_state = None
+            prev_child_result = None
+            matched = False
+        else:
+            matched = True
+
+        child_state, child_result = self._rerender_child(
+            key, child, prev_child, prev_child_state, prev_child_result,
+        )
+        state[key] = (hole, child, child_state)
+        return child_result, matched
+
+    def _unmount(self, state, result):
+        state, signals = state
+        unbind_signals(signals)
+        for hole, child, child_state in state.values():
+            if isinstance(child, Element):
+                child_result = self._template.get(result, hole)
+                child._unmount(child_state, child_result)
+
+    def _extract(self, state, result, key):
+        hole, child, child_state = state[0][key]
+        child_result = self._template.get(result, hole)
+        return child, child_state, child_result
+
+    def _insert(self, state, result, key, child_state, child_result):
+        state, signals = state
+        hole, child, _ = state[key]
+        state = {**state, key: (hole, child, child_state)}, signals
+        result = self._template.replace(result, hole, child_result)
+        return state, result
+
+
+class UnsupportedExpression(Exception):
+    pass
+
+
+class Analyzer:
+
+    def __init__(self, func):
+        self.func = func
+        self.local_names = {
+            *func.__code__.co_varnames,
+            *func.__code__.co_cellvars,
+            *func.__code__.co_freevars,
+        }
+        self.holes = []
+
+    def get_global(self, expr):
+        if not isinstance(expr, ast.Name) or expr.id in self.local_names:
+            raise UnsupportedExpression
+        try:
+            return self.func.__globals__[expr.id]
+        except KeyError:
+            raise UnsupportedExpression from None
+
+    def get_tag(self, expr):
+        if isinstance(expr, ast.Attribute):
+            if isinstance(self.get_global(expr.value), HTMLFactory):
+                return expr.attr.replace('_', '-')
+        elif isinstance(expr, ast.Subscript):
+            if (
+                isinstance(self.get_global(expr.value), HTMLFactory) and
+                isinstance(expr.slice, ast.Constant) and
+                isinstance(expr.slice.value, str)
+            ):
+                return expr.slice.value
+        else:
+            elem = self.get_global(expr)
+            if (
+                type(elem) is HTMLElement and
+                not elem._props and
+                not elem._children and
+                not hasattr(elem, '_key')
+            ):
+                return elem._tag
+        raise UnsupportedExpression
+
+    def analyze(self, expr):
+        holes = len(self.holes)
+        try:
+            return self.analyze_node(expr)
+        except UnsupportedExpression:
+            del self.holes[holes:]
+            raise
+
+    def analyze_node(self, expr):
+        calls = []
+        while isinstance(expr, ast.Call):
+            calls.append(expr)
+            expr = expr.func
+
+        tag = self.get_tag(expr)
+        key = NO_KEY
+        props = []
+        children = []
+
+        for call in reversed(calls):
+            for arg in call.args:
+                if isinstance(arg, ast.Starred):
+                    raise UnsupportedExpression
+                elif isinstance(arg, ast.Dict):
+                    for name, value in zip(arg.keys, arg.values):
+                        if not (
+                            isinstance(name, ast.Constant) and
+                            isinstance(name.value, str)
+                        ):
+                            raise UnsupportedExpression
+                        key = self.analyze_prop(props, name.value, value, key)
+                else:
+                    self.analyze_child(props, children, arg)
+
+            for keyword in call.keywords:
+                if keyword.arg is None:
+                    raise UnsupportedExpression
+                key = self.analyze_prop(
+                    props, keyword.arg, keyword.value, key,
+                )
+
+        if tag is None and any(not isinstance(op, int) for op in props):
+            raise UnsupportedExpression
+
+        return TemplateNode(tag, props, children), key
+
+    def analyze_prop(self, props, name, value, key):
+        if name == 'children':
+            raise UnsupportedExpression
+        elif name == 'key':
+            if not isinstance(value, ast.Constant):
+                raise UnsupportedExpression
+            return value.value
+        elif isinstance(value, ast.Constant):
+            props.append({name: value.value})
+        else:
+            props.append((name, self.add_hole(value)))
+        return key
+
+    def analyze_child(self, props, children, expr):
+        if isinstance(expr, ast.Constant):
+            value = expr.value
+            if value is None or value is False:
+                return
+            elif isinstance(value, (str, int, float)):
+                children.append(str(value))
+                return
+
+        try:
+            node, _ = self.analyze(expr)
+        except UnsupportedExpression:
+            hole = self.add_hole(expr)
+            props.append(hole)
+            children.append(hole)
+        else:
+            children.append(node)
+
+    def add_hole(self, expr):
+        self.holes.append(expr)
+        return len(self.holes) - 1
+
+
+class Compiler(ast.NodeTransformer):
+
+    def __init__(self, func):
+        self.func = func
+        self.templates = []
+        self.root = None
+
+    def visit_FunctionDef(self, node):
+        if self.root is None:
+            self.root = node
+            return self.generic_visit(node)
+        return node
+
+    def visit_AsyncFunctionDef(self, node):
+        return node
+
+    def visit_Lambda(self, node):
+        return node
+
+    def visit_ClassDef(self, node):
+        return node
+
+    def visit_Return(self, node):
+        if node.value is None:
+            return node
+
+        analyzer = Analyzer(self.func)
+        try:
+            root, key = analyzer.analyze(node.value)
+        except UnsupportedExpression:
+            return node
+
+        index = len(self.templates)
+        self.templates.append(Template(root, key))
+
+        node.value = ast.copy_location(ast.Call(
+            func=ast.Subscript(
+                value=ast.Name(id=TEMPLATES, ctx=ast.Load()),
+                slice=ast.Constant(value=index),
+                ctx=ast.Load(),
+            ),
+            args=analyzer.holes,
+            keywords=[],
+        ), node.value)
+        return ast.fix_missing_locations(node)
+
+
+def compiled(func):
+    if isinstance(func, Component):
+        return Component(compiled(func._func), func._props, func._children)
+
+    # the source of a wrapped function is the source of the function it wraps,
+    # compiling that would drop the decorators that wrap it
+    if inspect.unwrap(func) is not func:
+        return func
+
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        return func
+
+    funcdef = ast.parse(textwrap.dedent(source)).body[0]
+    if (
+        not isinstance(funcdef, ast.FunctionDef) or
+        funcdef.name != func.__name__
+    ):
+        return func
+    funcdef.decorator_list = []
+
+    compiler = Compiler(func)
+    compiler.visit(funcdef)
+    if not compiler.templates:
+        return func
+
+    # the function is defined within a factory that takes the free variables
+    # of the original function and the templates as arguments so we can
+    # supply these as closure when creating the new function
+    freevars = func.__code__.co_freevars
+    module = ast.parse(
+        f'def {TEMPLATES}factory({", ".join([*freevars, TEMPLATES])}):\n'
+        f'    return {funcdef.name}\n'
+    )
+    factory = module.body[0]
+    factory.body.insert(0, funcdef)
+    ast.increment_lineno(funcdef, func.__code__.co_firstlineno - 1)
+
+    code = compile(module, inspect.getsourcefile(func) or '<vivi>', 'exec')
+    factory_code, = (
+        const for const in code.co_consts if isinstance(const, CodeType)
+    )
+    func_code, = (
+        const for const in factory_code.co_consts
+        if isinstance(const, CodeType) and const.co_name == funcdef.name
+    )
+
+    cells = dict(zip(freevars, func.__closure__ or ()))
+    cells[TEMPLATES] = CellType(tuple(compiler.templates))
+
+    compiled_func = FunctionType(
+        func_code, func.__globals__, func.__name__, func.__defaults__,
+        tuple(cells[name] for name in func_code.co_freevars),
+    )
+    compiled_func.__kwdefaults__ = func.__kwdefaults__
+    return update_wrapper(compiled_func, func)
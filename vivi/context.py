@@ -42,7 +42,7 @@ def create_context(initial_value=None):
 
         return fragment(*children)
 
-    context_provider._vivi_context_key = key
+    context_provider._func._vivi_context_key = key
 
     def use_context():
         ctx = CONTEXT.get()
@@ -1,7 +1,12 @@
 from abc import ABC, abstractmethod
+import asyncio
+from functools import partial, wraps
+from inspect import iscoroutinefunction
+import operator
+from time import monotonic
 
-from .hooks import CONTEXT
-from .html import SafeText
+from .hooks import CONTEXT, _on_commit
+from .html import SafeText, HTMLNode, IDENTITY, NO_MAPPING
 
 
 INCOMPATIBLE = object()
@@ -11,8 +16,30 @@ EQUIVALENT = object()
 INDEX_KEY = object()
 
 
+def hash_value(value):
+    try:
+        return hash(value)
+    except TypeError:
+        pass
+
+    # unhashable values are hashed structurally, for values we cannot hash
+    # we fall back to the type so equal values still have equal hashes
+    if isinstance(value, dict):
+        return hash(frozenset(
+            (key, hash_value(item)) for key, item in value.items()
+        ))
+    elif isinstance(value, (list, tuple)):
+        return hash(tuple(map(hash_value, value)))
+    elif isinstance(value, (set, frozenset)):
+        return hash(frozenset(map(hash_value, value)))
+    else:
+        return hash(type(value))
+
+
 class Element(ABC):
 
+    __slots__ = ['_key', '_props', '_children', '_hash']
+
     def __init__(self, props, children):
         if 'children' in props:
             raise ValueError('\'children\' is not allowed as a property name')
@@ -120,7 +147,37 @@ class Element(ABC):
         assert elem is self
         return state, result
 
+    def _rerender_child(
+        self, key, child, prev_child, prev_child_state, prev_child_result,
+    ):
+        ctx = CONTEXT.get()
+        ctx.path.append(key)
+        try:
+            if isinstance(child, Element):
+                if not isinstance(prev_child, Element):
+                    prev_child = NONE
+                return child._rerender(
+                    prev_child, prev_child_state, prev_child_result,
+                )
+            else:
+                # text is kept as is instead of being wrapped in a literal
+                if isinstance(prev_child, Element):
+                    prev_child._unmount(prev_child_state, prev_child_result)
+                    ctx.rerender_paths.prune(ctx.path)
+                return None, child
+        finally:
+            ctx.path.pop()
+
     def __call__(self, *args, **kwargs):
+        for arg in args:
+            if isinstance(arg, dict):
+                break
+        else:
+            # fast path for when there are no prop dicts in args
+            props = {**self._props, **kwargs} if self._props else kwargs
+            children = (*self._children, *args) if self._children else args
+            return self._copy(props, children)
+
         props = dict(self._props)
         children = list(self._children)
 
@@ -137,6 +194,8 @@ class Element(ABC):
 
 class Literal(Element):
 
+    __slots__ = ['_value']
+
     def __init__(self, value):
         self._value = value
 
@@ -167,8 +226,13 @@ class Literal(Element):
         raise ValueError('literals do not have children')
 
 
+NONE = Literal(None)
+
+
 class HTMLElement(Element):
 
+    __slots__ = ['_tag']
+
     def __init__(self, tag, props, children):
         super().__init__(props, children)
         if tag is None and self._props:
@@ -179,13 +243,24 @@ class HTMLElement(Element):
         return HTMLElement(self._tag, props, children)
 
     def __eq__(self, other):
-        return (
+        return other is self or (
             isinstance(other, HTMLElement) and
+            hash(other) == hash(self) and
             other._tag == self._tag and
             other._props == self._props and
             other._children == self._children
         )
 
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash((
+                HTMLElement, self._tag,
+                hash_value(self._props), hash_value(self._children),
+            ))
+            return self._hash
+
     def _comp(self, elem):
         if elem == self:
             return EQUIVALENT
@@ -195,21 +270,30 @@ class HTMLElement(Element):
             return INCOMPATIBLE
 
     def _init(self):
-        return {}, (self._tag, self._props, {})
+        return ({}, None), HTMLNode(self._tag, self._props, NO_MAPPING, ())
 
     def _render(self, prev_state, prev_result):
         ctx = CONTEXT.get()
         state = {}
         child_results = []
         child_prev_indexes = {}
+        prev_child_results = prev_result.children
+        unmoved = True
 
+        prev_state, prev_signals = prev_state
         prev_state = prev_state.copy()
 
-        for index, child in enumerate(map(self._clean_elem, self._children)):
-            try:
-                key = child._key
-            except AttributeError:
+        for index, child in enumerate(self._children):
+            if child is False:
+                child = None
+            if child is None or isinstance(child, (str, SafeText)):
                 key = (INDEX_KEY, index)
+            else:
+                child = self._clean_elem(child)
+                try:
+                    key = child._key
+                except AttributeError:
+                    key = (INDEX_KEY, index)
 
             if key in state:
                 raise ValueError('duplicate keys')
@@ -217,60 +301,192 @@ class HTMLElement(Element):
             try:
                 prev_child, prev_child_state, prev_index = prev_state.pop(key)
             except KeyError:
-                prev_child = Literal(None)
+                prev_child = NONE
                 prev_child_state = None
                 prev_child_result = None
+                unmoved = False
             else:
-                prev_child_result = prev_result[prev_index + 3]
+                prev_child_result = prev_child_results[prev_index]
                 child_prev_indexes[index] = prev_index
+                if prev_index != index:
+                    unmoved = False
 
-            ctx.path.append(key)
-            try:
-                child_state, child_result = child._rerender(
-                    prev_child, prev_child_state, prev_child_result,
-                )
-            finally:
-                ctx.path.pop()
+            child_state, child_result = self._rerender_child(
+                key, child, prev_child, prev_child_state, prev_child_result,
+            )
 
             state[key] = (child, child_state, index)
             child_results.append(child_result)
 
+        signals = set()
+        props = resolve_signals(self._props, signals)
+        signals = bind_signals(signals, prev_signals)
+
         for prev_child, prev_child_state, prev_index in prev_state.values():
-            prev_child_result = prev_result[prev_index + 3]
-            prev_child._unmount(prev_child_state, prev_child_result)
+            if isinstance(prev_child, Element):
+                prev_child_result = prev_child_results[prev_index]
+                prev_child._unmount(prev_child_state, prev_child_result)
 
-        if 'ref' in self._props:
+        if 'ref' in props:
             ctx.static = False
 
-        result = (self._tag, self._props, child_prev_indexes, *child_results)
-        return state, result
+        if unmoved and len(prev_child_results) == len(child_results):
+            if (
+                all(map(
+                    operator.is_, child_results, prev_child_results,
+                )) and
+                (
+                    prev_result.props is props or
+                    prev_result.props == props
+                )
+            ):
+                return (state, signals), prev_result
+            mapping = IDENTITY
+        elif child_prev_indexes:
+            mapping = child_prev_indexes
+        else:
+            mapping = NO_MAPPING
+
+        result = HTMLNode(self._tag, props, mapping, tuple(child_results))
+        return (state, signals), result
 
     def _unmount(self, state, result):
+        state, signals = state
+        unbind_signals(signals)
         for child, child_state, index in state.values():
-            child_result = result[index + 3]
-            child._unmount(child_state, child_result)
+            if isinstance(child, Element):
+                child_result = result.children[index]
+                child._unmount(child_state, child_result)
 
     def _extract(self, state, result, key):
-        child, child_state, index = state[key]
-        child_result = result[index + 3]
+        child, child_state, index = state[0][key]
+        child_result = result.children[index]
         return child, child_state, child_result
 
     def _insert(self, state, result, key, child_state, child_result):
+        state, signals = state
         child, _, index = state[key]
-        state = {**state, key: (child, child_state, index)}
+        state = {**state, key: (child, child_state, index)}, signals
+
+        children = result.children
+        if child_result is children[index]:
+            return state, result
 
-        tag, props, _, *children = result
-        result = (
-            tag, props,
-            {i: i for i in range(len(children))},
-            *children[:index], child_result, *children[index + 1:],
+        result = HTMLNode(
+            result.tag, result.props, IDENTITY,
+            (*children[:index], child_result, *children[index + 1:]),
         )
 
         return state, result
 
 
+class Signal(Element):
+
+    __slots__ = ['_value', '_bindings']
+
+    def __init__(self, value=None):
+        self._value = value
+        self._bindings = set()
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        for rerender_path, path in self._bindings:
+            rerender_path(path)
+
+    def set(self, value):
+        if callable(value):
+            value = value(self._value)
+        self.value = value
+
+    def _copy(self, props, children):
+        raise ValueError('signals cannot be copied')
+
+    def _comp(self, elem):
+        if elem is self:
+            return EQUIVALENT
+        else:
+            return INCOMPATIBLE
+
+    def _init(self):
+        return None, None
+
+    def _render(self, prev_state, prev_result):
+        ctx = CONTEXT.get()
+        ctx.static = False
+
+        binding = (ctx.rerender_path, tuple(ctx.path))
+        _on_commit(partial(self._bindings.add, binding))
+
+        value = self._value
+        if value is None or value is False:
+            value = None
+        elif not isinstance(value, (str, SafeText)):
+            value = str(value)
+        return binding, value
+
+    def _unmount(self, state, result):
+        _on_commit(partial(self._bindings.discard, state))
+
+    def _extract(self, state, result, key):
+        raise ValueError('signals do not have children')
+
+    def _insert(self, state, result, key, child_state, child_result):
+        raise ValueError('signals do not have children')
+
+
+def resolve_signals(props, signals):
+    resolved_props = None
+    for key, value in props.items():
+        if isinstance(value, Signal):
+            if resolved_props is None:
+                resolved_props = dict(props)
+            resolved_props[key] = value._value
+            signals.add(value)
+    return props if resolved_props is None else resolved_props
+
+
+def bind_signals(signals, prev_signals):
+    # returns the signals bound by the props of an element along with their
+    # binding, or none, this is kept next to the child state of the element
+    if prev_signals is None:
+        prev_binding, prev_signals = None, ()
+    else:
+        prev_binding, prev_signals = prev_signals
+
+    if not signals and not prev_signals:
+        return None
+
+    ctx = CONTEXT.get()
+    ctx.static = False
+
+    # signals in props are bound to the path of the element itself so that a
+    # change only rerenders this element and not the component that made it
+    binding = (ctx.rerender_path, tuple(ctx.path))
+    for signal in prev_signals:
+        if signal not in signals or binding != prev_binding:
+            _on_commit(partial(signal._bindings.discard, prev_binding))
+    for signal in signals:
+        _on_commit(partial(signal._bindings.add, binding))
+    return binding, signals
+
+
+def unbind_signals(signals):
+    if signals is None:
+        return
+    binding, signals = signals
+    for signal in signals:
+        _on_commit(partial(signal._bindings.discard, binding))
+
+
 class Component(Element):
 
+    __slots__ = ['_func']
+
     def __init__(self, func, props, children):
         super().__init__(props, children)
         self._func = func
@@ -279,13 +495,24 @@ class Component(Element):
         return Component(self._func, props, children)
 
     def __eq__(self, other):
-        return (
+        return other is self or (
             isinstance(other, Component) and
+            hash(other) == hash(self) and
             other._func == self._func and
             other._props == self._props and
             other._children == self._children
         )
 
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash((
+                Component, hash_value(self._func),
+                hash_value(self._props), hash_value(self._children),
+            ))
+            return self._hash
+
     def _comp(self, elem):
         if elem == self:
             return EQUIVALENT
@@ -299,6 +526,21 @@ class Component(Element):
 
     def _render(self, prev_state, prev_result):
         ctx = CONTEXT.get()
+
+        if (
+            ctx.deadline is not None and
+            ctx.rendered and
+            monotonic() > ctx.deadline
+        ):
+            # out of time, keep the previous state and result for now and
+            # render this component, and everything that had to be rerendered
+            # below it, in a next pass
+            path = tuple(ctx.path)
+            ctx.deferred[path] = None
+            for subpath in ctx.rerender_paths.children(path):
+                ctx.deferred[subpath] = None
+            return prev_state, prev_result
+
         refs, prev_elem, prev_elem_state = prev_state
 
         ctx.refs = [] if refs is None else iter(refs)
@@ -320,6 +562,9 @@ class Component(Element):
         finally:
             del ctx.refs
 
+        if ctx.path:
+            ctx.rendered = True
+
         ctx.path.append('render')
         try:
             elem_state, result = elem._rerender(
@@ -334,9 +579,9 @@ class Component(Element):
         refs, elem, elem_state = state
         if isinstance(elem, Element):
             elem._unmount(elem_state, result)
-        for ref in refs:
+        for ref in refs or ():
             if hasattr(ref, '_vivi_cleanup'):
-                ref._vivi_cleanup()
+                _on_commit(ref._vivi_cleanup)
 
     def _extract(self, state, result, key):
         assert key == 'render'
@@ -349,20 +594,212 @@ class Component(Element):
         return (refs, child, child_state), child_result
 
 
+class Suspense(Element):
+
+    __slots__ = []
+
+    def _copy(self, props, children):
+        return Suspense(props, children)
+
+    def __eq__(self, other):
+        return other is self or (
+            isinstance(other, Suspense) and
+            hash(other) == hash(self) and
+            other._props == self._props and
+            other._children == self._children
+        )
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash((
+                Suspense,
+                hash_value(self._props), hash_value(self._children),
+            ))
+            return self._hash
+
+    def _comp(self, elem):
+        if elem == self:
+            return EQUIVALENT
+        elif isinstance(elem, Suspense):
+            return COMPATIBLE
+        else:
+            return INCOMPATIBLE
+
+    def _init(self):
+        state = (None, NONE, None, None, NONE, None, None, False, None)
+        return state, HTMLNode(None, {}, NO_MAPPING, ())
+
+    def _render(self, prev_state, prev_result):
+        ctx = CONTEXT.get()
+        (
+            _, prev_children, prev_children_state, prev_children_result,
+            fallback, fallback_state, fallback_result, suspended, switched,
+        ) = prev_state
+
+        path = tuple(ctx.path)
+        _, boundaries = ctx.suspense
+        boundaries[(*path, 'children')] = None
+        boundary = (path, boundaries)
+
+        children = HTMLElement(None, {}, self._children)
+        children_state, children_result = self._rerender_child(
+            'children', children,
+            prev_children, prev_children_state, prev_children_result,
+        )
+
+        return self._settle((
+            boundary, children, children_state, children_result,
+            fallback, fallback_state, fallback_result, suspended, switched,
+        ), prev_result)
+
+    def _settle(self, state, prev_result):
+        (
+            boundary, children, children_state, children_result,
+            prev_fallback, prev_fallback_state, prev_fallback_result,
+            prev_suspended, switched,
+        ) = state
+        path, boundaries = boundary
+
+        ctx = CONTEXT.get()
+        pending, _ = ctx.suspense
+        suspended = next(
+            pending.children((*path, 'children'), boundaries), None,
+        ) is not None
+
+        if suspended:
+            fallback = HTMLElement(None, {}, (self._props.get('fallback'),))
+            ctx_path = ctx.path
+            ctx.path = list(path)
+            try:
+                fallback_state, fallback_result = self._rerender_child(
+                    'fallback', fallback,
+                    prev_fallback, prev_fallback_state, prev_fallback_result,
+                )
+            finally:
+                ctx.path = ctx_path
+            result = fallback_result
+        else:
+            if isinstance(prev_fallback, Element):
+                prev_fallback._unmount(
+                    prev_fallback_state, prev_fallback_result,
+                )
+                ctx.rerender_paths.prune((*path, 'fallback'))
+            fallback = NONE
+            fallback_state = None
+            fallback_result = None
+            result = children_result
+
+        # the result of the other branch is not what the client has, so when
+        # switching branches it can not be mapped to the previous result, the
+        # same goes for later results in the same render as these are mapped
+        # to the results before them which are not what the client has either
+        if suspended != prev_suspended:
+            switched = ctx.render_id
+        if result.children is prev_result.children:
+            result = prev_result
+        elif switched is ctx.render_id:
+            result = HTMLNode(None, {}, NO_MAPPING, result.children)
+
+        return (
+            boundary, children, children_state, children_result,
+            fallback, fallback_state, fallback_result, suspended, switched,
+        ), result
+
+    def _unmount(self, state, result):
+        (
+            (path, boundaries), children, children_state, children_result,
+            fallback, fallback_state, fallback_result, _, _,
+        ) = state
+
+        _on_commit(partial(boundaries.__delitem__, (*path, 'children')))
+
+        children._unmount(children_state, children_result)
+        if isinstance(fallback, Element):
+            fallback._unmount(fallback_state, fallback_result)
+
+    def _extract(self, state, result, key):
+        if key == 'children':
+            return state[1:4]
+        else:
+            assert key == 'fallback'
+            return state[4:7]
+
+    def _insert(self, state, result, key, child_state, child_result):
+        if key == 'children':
+            state = (*state[:2], child_state, child_result, *state[4:])
+        else:
+            assert key == 'fallback'
+            state = (*state[:5], child_state, child_result, *state[7:])
+        return self._settle(state, result)
+
+
 class HTMLFactory:
 
+    def __init__(self):
+        self._elems = {}
+
     def __getattr__(self, name):
-        return HTMLElement(name.replace('_', '-'), {}, ())
+        if name.startswith('__'):
+            raise AttributeError(name)
+        elem = self[name.replace('_', '-')]
+        # elements are immutable so the element can be stored on the instance,
+        # next lookups of this tag then do not go through __getattr__ at all
+        setattr(self, name, elem)
+        return elem
 
     def __getitem__(self, name):
-        return HTMLElement(name, {}, ())
+        try:
+            return self._elems[name]
+        except KeyError:
+            elem = self._elems[name] = HTMLElement(name, {}, ())
+            return elem
 
 
 h = HTMLFactory()
 
 
+def _async_component(func):
+    from .hooks import use_ref, use_future
+
+    @wraps(func)
+    def render_async(**props):
+        ctx = CONTEXT.get()
+        path = tuple(ctx.path)
+        pending, _ = ctx.suspense
+
+        ref = use_ref(props=None, fut=None)
+        if ref.fut is None or ref.props != props:
+            if ref.fut is not None:
+                ref.fut.cancel()
+            ref.props = props
+            ref.fut = asyncio.ensure_future(func(**props))
+
+        if not hasattr(ref, '_vivi_cleanup'):
+            def cleanup():
+                ref.fut.cancel()
+                if path in pending:
+                    del pending[path]
+
+            ref._vivi_cleanup = cleanup
+
+        elem = use_future(ref.fut, eager=True)
+        if elem is use_future.LOADING:
+            pending[path] = None
+            return None
+        elif path in pending:
+            del pending[path]
+        return elem
+
+    return render_async
+
+
 def component(func):
+    if iscoroutinefunction(func):
+        func = _async_component(func)
     return Component(func, {}, ())
 
 
 fragment = HTMLElement(None, {}, ())
+suspense = Suspense({}, ())
@@ -1,3 +1,6 @@
+import weakref
+
+
 class CallbackWrapper:
 
     def __init__(self, callback, key, value):
@@ -13,6 +16,9 @@ class CallbackWrapper:
             other.value == self.value
         )
 
+    def __hash__(self):
+        return hash((CallbackWrapper, self.callback, self.key, self.value))
+
     def __call__(self, *args, **kwargs):
         return self.callback(*args, **kwargs)
 
@@ -23,3 +29,173 @@ def prevent_default(callback):
 
 def stop_propagation(callback):
     return CallbackWrapper(callback, 'stop_propagation', True)
+
+
+def delta(callback):
+    # send the value of the target as the edit relative to the value that was
+    # sent before instead of in full, for large text fields
+    return CallbackWrapper(callback, 'delta', True)
+
+
+def apply_delta(value, offset, delete_count, text):
+    # the offsets are in utf-16 code units like javascript strings, the
+    # inserted text can contain a lone surrogate if the edit splits a pair
+    data = value.encode('utf-16-le', 'surrogatepass')
+    return (
+        data[:2 * offset] +
+        text.encode('utf-16-le', 'surrogatepass') +
+        data[2 * (offset + delete_count):]
+    ).decode('utf-16-le', 'surrogatepass')
+
+
+def fields(*fields):
+    # only send these fields of the event, they are taken from the event if it
+    # has them and otherwise from its target
+    def decorator(callback):
+        return CallbackWrapper(callback, 'fields', fields)
+    return decorator
+
+
+def debounce(ms):
+    # only send the event once no new events came in for this many ms
+    def decorator(callback):
+        return CallbackWrapper(callback, 'debounce', ms)
+    return decorator
+
+
+def throttle(ms):
+    # send the event at most once per this many ms, the last event within such
+    # a window is sent at the end of it
+    def decorator(callback):
+        return CallbackWrapper(callback, 'throttle', ms)
+    return decorator
+
+
+def keys(*keys):
+    # only handle keyboard events for these keys, other keys are ignored
+    # entirely so they also do not prevent default or stop propagation
+    def decorator(callback):
+        return CallbackWrapper(callback, 'keys', keys)
+    return decorator
+
+
+class ClientActions:
+
+    # actions that the client executes by itself when the event happens, can
+    # be used as a callback to only run on the client or as a decorator to
+    # also call the decorated callback on the server
+    def __init__(self, actions):
+        self.actions = actions
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, ClientActions) and
+            other.actions == self.actions
+        )
+
+    def __hash__(self):
+        return hash((ClientActions, self.actions))
+
+    def __call__(self, callback):
+        return CallbackWrapper(callback, 'client', self.actions)
+
+
+def client(*actions):
+    return ClientActions(actions)
+
+
+# the targets of these actions are css selectors, or the element the callback
+# is on when omitted, the server does not know about the changes these make so
+# they are meant for attributes that the server does not render, the server
+# only sends an attribute when it changes in its own result but then it sends
+# the whole value, which replaces what the actions did (like a toggled class)
+
+def toggle_class(name, target=None):
+    return ('toggle_class', target, name)
+
+
+def set_attribute(key, value, target=None):
+    if value is True:
+        value = ''
+    elif value is False:
+        value = None
+    return ('set_attribute', target, key, value)
+
+
+def show(target=None):
+    return ('show', target)
+
+
+def hide(target=None):
+    return ('hide', target)
+
+
+def focus(target=None):
+    return ('focus', target)
+
+
+class Handlers:
+
+    # registry of the callbacks rendered in a session under compact ids, the
+    # client sends the id along with the event so the callback can be called
+    # directly, an id belongs to an event prop of a rendered node and is
+    # passed on to the node that takes its place in the next result, so the id
+    # stays the same when only the callback changes and the newest callback is
+    # stored under it, nodes compare by value so they are stored by id with a
+    # weakref that drops their callbacks once the node is gone
+    def __init__(self, delegate=False):
+        self.delegate = delegate
+        self._next_id = 0
+        self._nodes = {}
+        self._callbacks = {}
+
+    def register(self, node, key, callback):
+        handler_ids = self._handler_ids(node)
+        try:
+            handler_id = handler_ids[key]
+        except KeyError:
+            handler_id = handler_ids[key] = self._next_id
+            self._next_id += 1
+        self._callbacks[handler_id] = callback
+        return handler_id
+
+    def move(self, old_node, new_node):
+        try:
+            ref, handler_ids = self._nodes.pop(id(old_node))
+        except KeyError:
+            return
+        entry = self._nodes.get(id(new_node))
+        if ref() is not old_node or (
+            entry is not None and entry[0]() is new_node
+        ):
+            self._forget(handler_ids)
+        else:
+            self._handler_ids(new_node).update(handler_ids)
+
+    def _handler_ids(self, node):
+        key = id(node)
+        try:
+            ref, handler_ids = self._nodes[key]
+        except KeyError:
+            pass
+        else:
+            if ref() is node:
+                return handler_ids
+            self._forget(handler_ids)
+
+        def remove(ref):
+            entry = self._nodes.get(key)
+            if entry is not None and entry[0] is ref:
+                del self._nodes[key]
+                self._forget(entry[1])
+
+        handler_ids = {}
+        self._nodes[key] = (weakref.ref(node, remove), handler_ids)
+        return handler_ids
+
+    def _forget(self, handler_ids):
+        for handler_id in handler_ids.values():
+            self._callbacks.pop(handler_id, None)
+
+    def __getitem__(self, handler_id):
+        return self._callbacks[handler_id]
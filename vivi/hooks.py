@@ -11,6 +11,17 @@ from .shared import create_shared
 
 
 CONTEXT = ContextVar('context')
+TRANSITION = ContextVar('transition', default=False)
+
+
+def _on_commit(callback):
+    # side effects of a transition render wait until the transition is
+    # committed so they are dropped along with it when it is interrupted
+    commits = getattr(CONTEXT.get(None), 'commits', None)
+    if commits is None:
+        callback()
+    else:
+        commits.append(callback)
 
 
 def use_ref(**kwargs):
@@ -52,6 +63,74 @@ def use_state(initial_value=None):
     return ref.value, ref.set_value
 
 
+def use_signal(initial_value=None):
+    from .elements import Signal
+
+    ref = use_ref()
+
+    if not hasattr(ref, 'signal'):
+        if callable(initial_value):
+            initial_value = initial_value()
+        ref.signal = Signal(initial_value)
+
+    return ref.signal
+
+
+def use_transition():
+    ctx = CONTEXT.get()
+
+    ref = use_ref(pending=False)
+    ctx.static = False
+    ref.path = tuple(ctx.path)
+    ref.rerender_path = ctx.rerender_path
+    ref.end_transition = ctx.end_transition
+
+    if not hasattr(ref, 'start_transition'):
+        def end_transition():
+            ref.pending = False
+            ref.rerender_path(ref.path)
+
+        def start_transition(callback):
+            token = TRANSITION.set(True)
+            try:
+                callback()
+            finally:
+                TRANSITION.reset(token)
+
+            ref.pending = True
+            ref.rerender_path(ref.path)
+            ref.end_transition(end_transition)
+
+        ref.start_transition = start_transition
+
+    return ref.pending, ref.start_transition
+
+
+def use_deferred_value(value):
+    ctx = CONTEXT.get()
+
+    ref = use_ref()
+    ref.path = tuple(ctx.path)
+    ref.rerender_path = ctx.rerender_path
+
+    if not hasattr(ref, 'value'):
+        ref.value = value
+    elif ctx.transition:
+        def commit():
+            ref.value = value
+
+        _on_commit(commit)
+        return value
+    elif ref.value != value:
+        token = TRANSITION.set(True)
+        try:
+            ref.rerender_path(ref.path)
+        finally:
+            TRANSITION.reset(token)
+
+    return ref.value
+
+
 def use_memo(*key):
     def decorator(callback):
         ref = use_ref()
@@ -74,11 +153,22 @@ def use_effect(*key, immediate=False):
         if not hasattr(ref, 'key') or ref.key != key:
             loop = asyncio.get_running_loop()
 
-            ref.key = key
+            def commit():
+                # a transition can render this more than once before it is
+                # committed
+                if hasattr(ref, 'key') and ref.key == key:
+                    return
+
+                ref.key = key
+
+                if hasattr(ref, '_vivi_cleanup'):
+                    ref._vivi_cleanup()
+                    del ref._vivi_cleanup
 
-            if hasattr(ref, '_vivi_cleanup'):
-                ref._vivi_cleanup()
-                del ref._vivi_cleanup
+                if immediate:
+                    wrapped_callback()
+                else:
+                    loop.call_soon(wrapped_callback)
 
             def wrapped_callback():
                 cleanup = callback()
@@ -88,10 +178,7 @@ def use_effect(*key, immediate=False):
                     else:
                         ref._vivi_cleanup = lambda: loop.call_soon(cleanup)
 
-            if immediate:
-                wrapped_callback()
-            else:
-                loop.call_soon(wrapped_callback)
+            _on_commit(commit)
 
         return callback
     return decorator
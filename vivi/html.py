@@ -1,10 +1,85 @@
 import asyncio
 from collections import defaultdict, deque
 import html
-from itertools import islice
 import json
-
-from .events import CallbackWrapper
+import operator
+from types import MappingProxyType
+from urllib.parse import quote
+import weakref
+
+from .events import CallbackWrapper, ClientActions
+
+
+NO_VALUE = object()
+# inserted subtrees with at least this many elements are sent as html
+HTML_PAYLOAD_SIZE = 64
+TEMPLATE_LIMIT = 256
+VOID_TAGS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+    'source', 'track', 'wbr',
+}
+# tags whose content does not parse back to the same nodes
+RAW_TAGS = {
+    'script', 'style', 'template', 'noscript', 'iframe', 'noembed', 'noframes',
+    'xmp', 'plaintext',
+}
+# tags the html parser rewrites or drops wherever they appear in a fragment
+UNPARSED_TAGS = {
+    'html', 'head', 'body', 'frameset', 'frame', 'image', 'svg', 'math',
+}
+# elements the html parser only keeps these child elements in, others are
+# moved out of the element or dropped, or get a parent inserted like a tbody
+CHILD_TAGS = {
+    'table': {'caption', 'colgroup', 'thead', 'tbody', 'tfoot'},
+    'thead': {'tr'},
+    'tbody': {'tr'},
+    'tfoot': {'tr'},
+    'tr': {'td', 'th'},
+    'colgroup': {'col'},
+    'select': {'option', 'optgroup', 'hr'},
+    'optgroup': {'option'},
+    'option': set(),
+}
+# elements that are dropped by the html parser outside of these parents
+PARENT_TAGS = {
+    'caption': {'table'},
+    'colgroup': {'table'},
+    'thead': {'table'},
+    'tbody': {'table'},
+    'tfoot': {'table'},
+    'tr': {'thead', 'tbody', 'tfoot'},
+    'td': {'tr'},
+    'th': {'tr'},
+    'col': {'colgroup'},
+}
+# text in these elements is moved in front of the table
+TEXTLESS_TAGS = {'table', 'thead', 'tbody', 'tfoot', 'tr', 'colgroup'}
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+# tags that close an open element anywhere up the tree when they are parsed
+CLOSING_TAGS = {
+    'p': {
+        'address', 'article', 'aside', 'blockquote', 'center', 'details',
+        'dialog', 'dir', 'div', 'dl', 'fieldset', 'figcaption', 'figure',
+        'footer', 'header', 'hgroup', 'main', 'menu', 'nav', 'ol', 'p',
+        'search', 'section', 'summary', 'ul', 'h1', 'h2', 'h3', 'h4', 'h5',
+        'h6', 'pre', 'listing', 'form', 'li', 'dd', 'dt', 'plaintext',
+        'table', 'hr', 'xmp',
+    },
+    'a': {'a'},
+    'form': {'form'},
+    'button': {'button'},
+    'nobr': {'nobr'},
+    'li': {'li'},
+    'dd': {'dd', 'dt'},
+    'dt': {'dd', 'dt'},
+}
+# elements that end the reach of open elements for the closing tags above
+SCOPE_TAGS = {
+    'ul': {'li'},
+    'ol': {'li'},
+    'dl': {'dd', 'dt'},
+    'button': {'p'},
+}
 
 
 class SafeText:
@@ -50,19 +125,226 @@ class SafeText:
         return joined
 
 
-def clean_value(value):
-    if not callable(value):
+class IdentityMapping:
+
+    __slots__ = []
+
+    def __getitem__(self, index):
+        return index
+
+    def get(self, index, default=None):
+        return index
+
+    def __repr__(self):
+        return 'IDENTITY'
+
+
+IDENTITY = IdentityMapping()
+NO_MAPPING = MappingProxyType({})
+
+
+def join_text(text, other):
+    if isinstance(text, str) and isinstance(other, str):
+        return text + other
+    if isinstance(text, str):
+        text = html.escape(text, quote=False)
+    else:
+        text = text.text
+    if isinstance(other, str):
+        other = html.escape(other, quote=False)
+    else:
+        other = other.text
+    return SafeText(text + other)
+
+
+class HTMLNode:
+
+    __slots__ = [
+        'tag', 'props', 'mapping', 'children', '_flat', '_path_indexes',
+        '_ref_count', '__weakref__',
+    ]
+
+    def __init__(self, tag, props, mapping, children):
+        self.tag = tag
+        self.props = props
+        self.mapping = mapping
+        self.children = children
+        self._flat = None
+        self._path_indexes = None
+        self._ref_count = None
+
+    @property
+    def flat(self):
+        if self._flat is None:
+            self._flatten()
+        return self._flat
+
+    @property
+    def path_indexes(self):
+        if self._path_indexes is None:
+            self._flatten()
+        return self._path_indexes
+
+    @property
+    def ref_count(self):
+        # the amount of nodes with a ref prop in this subtree, unchanged
+        # subtrees reuse their nodes so this is only counted for new nodes
+        if self._ref_count is None:
+            ref_count = int('ref' in self.props)
+            for child in self.children:
+                if isinstance(child, HTMLNode):
+                    ref_count += child.ref_count
+            self._ref_count = ref_count
+        return self._ref_count
+
+    def _flatten(self):
+        flat = []
+        path_indexes = {}
+        text = None
+
+        for index, child in enumerate(self.children):
+            if child is None:
+                continue
+
+            if isinstance(child, HTMLNode) and child.tag is None:
+                child_flat = child.flat
+                child_paths = {
+                    flat_index: path
+                    for path, flat_index in child.path_indexes.items()
+                }
+                items = (
+                    (
+                        node,
+                        None
+                        if isinstance(node, (str, SafeText)) else
+                        (index, *child_paths[flat_index]),
+                    )
+                    for flat_index, node in enumerate(child_flat)
+                )
+            elif isinstance(child, (str, SafeText)):
+                items = [(child, None)]
+            else:
+                items = [(child, (index,))]
+
+            for node, path in items:
+                if path is None:
+                    text = node if text is None else join_text(text, node)
+                    continue
+                if text:
+                    flat.append(text)
+                text = None
+                path_indexes[path] = len(flat)
+                flat.append(node)
+
+        if text:
+            flat.append(text)
+
+        if (
+            len(flat) == len(self.children) and
+            all(map(operator.is_, flat, self.children))
+        ):
+            flat = self.children
+        else:
+            flat = tuple(flat)
+
+        self._flat = flat
+        self._path_indexes = path_indexes
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, HTMLNode) and
+            other.tag == self.tag and
+            other.props == self.props and
+            other.children == self.children
+        )
+
+    __hash__ = None
+
+    def __repr__(self):
+        return (
+            f'HTMLNode({self.tag!r}, {self.props!r}, {self.mapping!r}, '
+            f'{self.children!r})'
+        )
+
+
+class ReportedValues:
+
+    # the values the client reported for its inputs by node, nodes compare by
+    # value so they are stored by id, with a weakref that removes the entry
+    # once the node is gone
+    def __init__(self):
+        self._values = {}
+
+    def __setitem__(self, node, value):
+        key = id(node)
+        ref = weakref.ref(node, lambda _: self._values.pop(key, None))
+        self._values[key] = (ref, value)
+
+    def pop(self, node, default=NO_VALUE):
+        try:
+            ref, value = self._values[id(node)]
+        except KeyError:
+            return default
+        if ref() is not node:
+            return default
+        del self._values[id(node)]
         return value
 
+
+def clean_options(args):
+    # options other than the flags are encoded as space separated name=value
+    # pairs, where lists are joined with commas and the values are quoted so
+    # they can contain spaces and commas themselves
+    parts = []
+    for key, value in args.items():
+        if key in ('prevent_default', 'stop_propagation'):
+            continue
+        if value is True:
+            parts.append(key)
+            continue
+        if not isinstance(value, (list, tuple)):
+            value = [value]
+        value = ','.join(quote(str(item), safe='') for item in value)
+        parts.append(f'{key}={value}')
+    return ' '.join(parts)
+
+
+def clean_prop(node, key, value, handlers=None):
+    if not callable(value):
+        return key, value
+
     args = {
         'prevent_default': False,
         'stop_propagation': False,
     }
 
+    callback = value
     while isinstance(value, CallbackWrapper):
         args[value.key] = value.value
         value = value.callback
 
+    # callbacks that only consist of client actions are not sent to the server
+    if isinstance(value, ClientActions):
+        args['client'] = value.actions
+        callback = None
+    if 'client' in args:
+        args['client'] = json.dumps(args['client'], separators=(',', ':'))
+
+    options = clean_options(args)
+
+    if handlers is not None and handlers.delegate:
+        parts = [
+            '-' if callback is None else
+            str(handlers.register(node, key, callback)),
+        ]
+        if args['prevent_default']:
+            parts.append('p')
+        if args['stop_propagation']:
+            parts.append('s')
+        if options:
+            parts.append(options)
+        return f'data-{key}', ' '.join(parts)
+
     parts = ['call(event']
     for arg in [
         'prevent_default',
@@ -70,22 +352,35 @@ def clean_value(value):
     ]:
         parts.append(', ')
         parts.append(json.dumps(args[arg]))
+    if handlers is not None or options or callback is None:
+        parts.append(', ')
+        if callback is None:
+            parts.append('false')
+        elif handlers is None:
+            parts.append('null')
+        else:
+            parts.append(str(handlers.register(node, key, callback)))
+    if options:
+        parts.append(', ')
+        parts.append(json.dumps(options))
     parts.append(')')
-    return ''.join(parts)
+    return key, ''.join(parts)
 
 
-def clean_node(node):
-    if not isinstance(node, tuple):
-        return node
+def clean_props(node, handlers=None):
+    return dict(
+        clean_prop(node, key, value, handlers)
+        for key, value in node.props.items()
+        if key != 'ref'
+    )
 
-    tag, props, _, *children = node
 
-    cleaned_props = {}
-    for key, value in props.items():
-        if key == 'ref':
-            continue
+def clean_node(node, handlers=None):
+    if not isinstance(node, HTMLNode):
+        return node
 
-        value = clean_value(value)
+    cleaned_props = {}
+    for key, value in clean_props(node, handlers).items():
         if value is False:
             continue
         if value is True:
@@ -95,93 +390,175 @@ def clean_node(node):
         cleaned_props[key] = value
 
     return (
-        tag, cleaned_props,
-        *map(clean_node, html_flatten((None, {}, {}, *children))),
+        node.tag, cleaned_props,
+        *(clean_node(child, handlers) for child in node.flat),
     )
 
 
-def html_flatten(node):
-    if not isinstance(node, tuple) or node[0] is not None:
-        if node is None:
-            return {}
-        yield node
-        return {(): 0}
+class Templates:
 
-    stack = [(enumerate(islice(node, 3, None)), ())]
-    flat_index = 0
-    path_indexes = {}
+    # the shapes of the subtrees that were inserted before, once a shape
+    # repeats the client keeps a clone of the subtree so later subtrees with
+    # the same shape can be sent as [template_id, *values] where the values
+    # are the attribute values and texts in document order
+    def __init__(self, limit=TEMPLATE_LIMIT):
+        self._limit = limit
+        self._ids = {}
+        self._seen = set()
 
-    while stack:
-        nodes, path = stack[-1]
+    def encode(self, data, max_size=HTML_PAYLOAD_SIZE):
+        values = []
+        shape, size = _payload_shape(data, values)
         try:
-            index, node = next(nodes)
-        except StopIteration:
-            stack.pop()
-            continue
+            return [self._ids[shape], *values]
+        except KeyError:
+            pass
 
-        if isinstance(node, tuple) and node[0] is None:
-            stack.append((enumerate(islice(node, 3, None)), (*path, index)))
-            continue
+        if size >= max_size or len(self._ids) >= self._limit:
+            return data
+
+        if shape not in self._seen:
+            # shapes that do not repeat are forgotten again eventually
+            if len(self._seen) >= self._limit:
+                self._seen.clear()
+            self._seen.add(shape)
+            return data
+
+        self._seen.discard(shape)
+        template_id = len(self._ids)
+        self._ids[shape] = template_id
+        return {'define': template_id, 'node': data}
+
+
+def html_payloads(actions, templates=None, min_size=HTML_PAYLOAD_SIZE):
+    # big inserted subtrees are sent as html so the client can parse them in
+    # one go instead of creating every node separately, this is only done for
+    # subtrees that parse back to the same nodes, smaller subtrees go through
+    # the templates
+    for action in actions:
+        if (
+            action[0] in ('insert', 'replace') and
+            isinstance(action[-1], tuple)
+        ):
+            data = action[-1]
+            parts = []
+            size = _payload_html(data, parts, None, frozenset())
+            if size is not None and size >= min_size:
+                action = (*action[:-1], {'html': ''.join(parts)})
+            elif templates is not None:
+                action = (*action[:-1], templates.encode(data, min_size))
+        yield action
+
+
+def _payload_shape(data, values):
+    if not isinstance(data, tuple):
+        values.append(data)
+        return None, 0
+
+    tag, props, *children = data
+    values.extend(props.values())
+
+    size = 1
+    shapes = []
+    for child in children:
+        shape, child_size = _payload_shape(child, values)
+        shapes.append(shape)
+        size += child_size
+
+    return (tag, tuple(props), tuple(shapes)), size
+
+
+def _parses_in(tag, parent, open_tags):
+    # whether the html parser keeps an element with this tag in this parent
+    # where open_tags are the tags of the ancestors that a tag could close,
+    # the root of the subtree is parsed in a template so it can be anything
+    if tag in UNPARSED_TAGS:
+        return False
+    if parent is None:
+        return True
+    if parent in CHILD_TAGS and tag not in CHILD_TAGS[parent]:
+        return False
+    if tag in PARENT_TAGS and parent not in PARENT_TAGS[tag]:
+        return False
+    if tag in HEADING_TAGS and parent in HEADING_TAGS:
+        return False
+    return not any(tag in CLOSING_TAGS[open_tag] for open_tag in open_tags)
+
+
+def _payload_html(data, parts, parent, open_tags):
+    tag, props, *children = data
+    if (
+        tag in RAW_TAGS or
+        (tag in VOID_TAGS and children) or
+        not _parses_in(tag, parent, open_tags)
+    ):
+        return None
+
+    open_tags = open_tags.difference(SCOPE_TAGS.get(tag, ()))
+    if tag in CLOSING_TAGS:
+        open_tags = open_tags.union((tag,))
+
+    parts.append('<')
+    parts.append(tag)
+    for key, value in props.items():
+        parts.append(' ')
+        parts.append(key)
+        parts.append('="')
+        parts.append(html.escape(value))
+        parts.append('"')
+    parts.append('>')
+
+    size = 1
+    prev_text = False
+    for child in children:
+        if isinstance(child, tuple):
+            child_size = _payload_html(child, parts, tag, open_tags)
+            if child_size is None:
+                return None
+            size += child_size
+            prev_text = False
+        else:
+            # adjacent or empty text would be parsed as fewer text nodes
+            if prev_text or not child or tag in TEXTLESS_TAGS:
+                return None
+            if isinstance(child, SafeText):
+                parts.append(child.text)
+            else:
+                parts.append(html.escape(child, quote=False))
+            prev_text = True
 
-        if isinstance(node, (str, SafeText)):
-            while stack:
-                nodes, path = stack[-1]
-                try:
-                    index, next_node = next(nodes)
-                except StopIteration:
-                    stack.pop()
-                    continue
+    if tag not in VOID_TAGS:
+        parts.append('</')
+        parts.append(tag)
+        parts.append('>')
 
-                if isinstance(next_node, tuple) and next_node[0] is None:
-                    stack.append((
-                        enumerate(islice(next_node, 3, None)),
-                        (*path, index),
-                    ))
-                    continue
+    return size
 
-                if isinstance(next_node, str):
-                    if isinstance(node, str):
-                        node += next_node
-                    else:
-                        node = SafeText(
-                            node.text +
-                            html.escape(next_node, quote=False)
-                        )
-                elif isinstance(next_node, SafeText):
-                    if isinstance(node, str):
-                        node = SafeText(
-                            html.escape(node, quote=False) +
-                            next_node.text
-                        )
-                    else:
-                        node = SafeText(node.text + next_node.text)
-                else:
-                    if node:
-                        yield node
-                        flat_index += 1
-                    node = next_node
-                    break
 
-        if node is not None:
-            yield node
-            if not isinstance(node, (str, SafeText)):
-                path_indexes[(*path, index)] = flat_index
-            flat_index += 1
+def html_flatten(node):
+    if not isinstance(node, HTMLNode) or node.tag is not None:
+        if node is None:
+            return {}
+        yield node
+        return {(): 0}
 
-    return path_indexes
+    yield from node.flat
+    return node.path_indexes
 
 
 def html_get(node, index):
-    if node[0] is not None:
-        node = (None, {}, {}, *node[3:])
     try:
-        return next(islice(html_flatten(node), index, None))
-    except StopIteration:
+        return node.flat[index]
+    except IndexError:
         raise IndexError('node index out of range') from None
 
 
-def html_parts(node):
-    for node in html_flatten(node):
+def html_parts(node, handlers=None):
+    return _html_parts(html_flatten(node), handlers)
+
+
+def _html_parts(nodes, handlers):
+    for node in nodes:
         if isinstance(node, SafeText):
             yield node.text
             continue
@@ -190,15 +567,9 @@ def html_parts(node):
             yield html.escape(node, quote=False)
             continue
 
-        tag, props, _, *children = node
-
         yield '<'
-        yield tag
-        for key, value in props.items():
-            if key == 'ref':
-                continue
-
-            value = clean_value(value)
+        yield node.tag
+        for key, value in clean_props(node, handlers).items():
             if value is False:
                 continue
             yield ' '
@@ -212,44 +583,44 @@ def html_parts(node):
             yield '"'
         yield '>'
 
-        yield from html_parts((None, {}, {}, *children))
+        yield from _html_parts(node.flat, handlers)
 
         yield '</'
-        yield tag
+        yield node.tag
         yield '>'
 
 
 def html_flatten_with_mapping(old_node, new_node):
-    old_nodes_iter = html_flatten(old_node)
-    old_nodes = []
-    while True:
-        try:
-            old_nodes.append(next(old_nodes_iter))
-        except StopIteration as e:
-            old_path_indexes = e.value
-            break
-
-    new_nodes_iter = html_flatten(new_node)
-    new_nodes = []
-    while True:
-        try:
-            new_nodes.append(next(new_nodes_iter))
-        except StopIteration as e:
-            new_path_indexes = e.value
-            break
+    new_nodes = new_node.flat
+    new_path_indexes = new_node.path_indexes
 
     index_mapping = {}
+    if old_node is None:
+        return (), new_nodes, index_mapping
+
+    old_nodes = old_node.flat
+    old_path_indexes = old_node.path_indexes
+
     for new_path, new_index in new_path_indexes.items():
         node = new_node
+        prev_node = old_node
         old_path = []
-        for index in new_path:
+        for depth, index in enumerate(new_path):
+            # a result that is reused as is still has the mapping to the
+            # result it was originally rendered from, so from this point on
+            # the paths are the same
+            if node is prev_node:
+                old_path.extend(new_path[depth:])
+                break
             try:
-                old_index = node[2][index]
+                old_index = node.mapping[index]
             except KeyError:
                 break
-            node = node[index + 3]
+            node = node.children[index]
+            prev_node = prev_node.children[old_index]
             old_path.append(old_index)
-        else:
+
+        if len(old_path) == len(new_path):
             try:
                 old_index = old_path_indexes[tuple(old_path)]
             except KeyError:
@@ -260,7 +631,42 @@ def html_flatten_with_mapping(old_node, new_node):
     return old_nodes, new_nodes, index_mapping
 
 
-def html_diff(old_node, new_node, path=()):
+def html_rebase(base_node, prev_node, new_node):
+    # new_node has mappings relative to prev_node which itself has mappings
+    # relative to base_node, this returns new_node with its mappings relative
+    # to base_node instead
+    if (
+        new_node is prev_node or
+        prev_node is base_node or
+        not isinstance(new_node, HTMLNode) or
+        not isinstance(prev_node, HTMLNode)
+    ):
+        return new_node
+
+    mapping = {}
+    children = list(new_node.children)
+
+    for index, child in enumerate(children):
+        try:
+            prev_index = new_node.mapping[index]
+            base_index = prev_node.mapping[prev_index]
+        except KeyError:
+            continue
+
+        mapping[index] = base_index
+        children[index] = html_rebase(
+            base_node.children[base_index],
+            prev_node.children[prev_index],
+            child,
+        )
+
+    if new_node.mapping is IDENTITY and prev_node.mapping is IDENTITY:
+        mapping = IDENTITY
+
+    return HTMLNode(new_node.tag, new_node.props, mapping, tuple(children))
+
+
+def html_diff(old_node, new_node, path=(), handlers=None, values=None):
     old_nodes, new_nodes, index_mapping = (
         html_flatten_with_mapping(old_node, new_node)
     )
@@ -280,106 +686,119 @@ def html_diff(old_node, new_node, path=()):
             else:
                 index_mapping[new_index] = old_index
 
-    rev_index_mapping = {value: key for key, value in index_mapping.items()}
+    mapped_old_indexes = set(index_mapping.values())
 
     inserts = deque()
-    removes = 0
-    waiting = {}
-    index = 0
+    # nodes before index, None for nodes that are done and the old index for
+    # nodes that are mapped to a new node later on and thus have to be moved
+    waiting = []
     old_index = 0
 
     for new_index, new_node in enumerate(new_nodes):
-        if new_index not in index_mapping:
+        try:
+            target_old_index = index_mapping[new_index]
+        except KeyError:
             inserts.append(new_node)
             continue
 
-        try:
-            curr_index = waiting.pop(new_index)
-        except KeyError:
-            target_old_index = index_mapping[new_index]
+        if target_old_index < old_index:
+            curr_index = waiting.index(target_old_index)
+            del waiting[curr_index]
+            if curr_index != len(waiting):
+                yield ('move', *path, curr_index, len(waiting))
+        else:
             while old_index < target_old_index:
-                try:
-                    new_index_ = rev_index_mapping[old_index]
-                except KeyError:
-                    removes += 1
+                if old_index in mapped_old_indexes:
+                    waiting.append(old_index)
+                elif inserts:
+                    yield (
+                        'replace', *path, len(waiting),
+                        clean_node(inserts.popleft(), handlers),
+                    )
+                    waiting.append(None)
                 else:
-                    waiting[new_index] = index
-                    index += 1
+                    yield ('remove', *path, len(waiting))
                 old_index += 1
-        else:
-            index -= 1
-            yield ('move', *path, curr_index, index)
-            for new_index_, curr_index_ in waiting.items():
-                if curr_index < curr_index_:
-                    waiting[new_index_] = curr_index_ - 1
+            old_index += 1
 
         while inserts:
-            if removes:
-                action = 'replace'
-                removes -= 1
-            else:
-                action = 'insert'
-            yield (action, *path, index, clean_node(inserts.popleft()))
-            index += 1
-
-        while removes:
-            yield ('remove', *path, index)
-            removes -= 1
+            yield (
+                'insert', *path, len(waiting),
+                clean_node(inserts.popleft(), handlers),
+            )
+            waiting.append(None)
 
-        old_node = old_nodes[old_index]
+        index = len(waiting)
+        waiting.append(None)
+        old_node = old_nodes[target_old_index]
 
         if old_node is new_node:
             pass
         elif (
-            isinstance(old_node, tuple) and
-            isinstance(new_node, tuple) and
-            old_node[0] == new_node[0]
+            isinstance(old_node, HTMLNode) and
+            isinstance(new_node, HTMLNode) and
+            old_node.tag == new_node.tag
         ):
-            _, old_props, old_mapping, *old_children = old_node
-            _, new_props, new_mapping, *new_children = new_node
-
-            for key in set(old_props) - set(new_props):
+            old_props = clean_props(old_node, handlers)
+            # the new node takes over the handler ids of the old node, so only
+            # callbacks that change how they are sent result in a set
+            if handlers is not None:
+                handlers.move(old_node, new_node)
+            new_props = clean_props(new_node, handlers)
+
+            # the value the client reported for this input, setting the input
+            # to this value would only echo it back
+            reported = NO_VALUE
+            if values is not None:
+                reported = values.pop(old_node, NO_VALUE)
+
+            for key in old_props.keys() - new_props.keys():
                 yield ('unset', *path, index, key)
 
             for key, value in new_props.items():
-                value = clean_value(value)
-                if (
-                    key not in old_props or
-                    clean_value(old_props[key]) != value
-                ):
+                if key not in old_props or old_props[key] != value:
                     if value is False:
                         yield ('unset', *path, index, key)
                         continue
                     if value is True:
                         value = ''
+                    if key == 'value' and str(value) == reported:
+                        continue
                     yield ('set', *path, index, key, value)
 
+            # if the value is not set the client keeps the reported value
+            if (
+                reported is not NO_VALUE and
+                old_props.get('value') == new_props.get('value') and
+                str(new_props.get('value')) != reported
+            ):
+                values[new_node] = reported
+
             yield from html_diff(
-                (None, {}, old_mapping, *old_children),
-                (None, {}, new_mapping, *new_children),
-                (*path, index),
+                old_node, new_node, (*path, index), handlers, values,
             )
         elif old_node != new_node:
-            yield ('replace', *path, index, clean_node(new_node))
+            yield ('replace', *path, index, clean_node(new_node, handlers))
 
-        old_index += 1
-        index += 1
+    index = len(waiting)
 
-    removes += len(old_nodes) - old_index
+    for _ in range(old_index, len(old_nodes)):
+        if inserts:
+            yield (
+                'replace', *path, index,
+                clean_node(inserts.popleft(), handlers),
+            )
+            index += 1
+        else:
+            yield ('remove', *path, index)
 
     while inserts:
-        if removes:
-            action = 'replace'
-            removes -= 1
-        else:
-            action = 'insert'
-        yield (action, *path, index, clean_node(inserts.popleft()))
+        yield (
+            'insert', *path, index,
+            clean_node(inserts.popleft(), handlers),
+        )
         index += 1
 
-    while removes:
-        yield ('remove', *path, index)
-        removes -= 1
-
 
 def html_refs(old_node, new_node, queue, subscriptions, path=(), root=None):
     loop = asyncio.get_running_loop()
@@ -387,6 +806,10 @@ def html_refs(old_node, new_node, queue, subscriptions, path=(), root=None):
     if new_node is old_node:
         return
 
+    # there are no refs to (un)mount in branches without any refs
+    if not new_node.ref_count and (old_node is None or not old_node.ref_count):
+        return
+
     if root is None:
         root = new_node
 
@@ -400,18 +823,28 @@ def html_refs(old_node, new_node, queue, subscriptions, path=(), root=None):
         if old_index in mapped_old_nodes:
             continue
 
-        if not isinstance(old_node, tuple):
+        if not isinstance(old_node, HTMLNode):
             continue
 
-        try:
-            ref = old_node[1]['ref']
-        except KeyError:
-            pass
-        else:
-            loop.call_soon(ref, None)
+        # refs can be anywhere in the removed subtree, but we only have to
+        # descend into the branches that contain any
+        stack = [old_node]
+        while stack:
+            old_node = stack.pop()
+            try:
+                ref = old_node.props['ref']
+            except KeyError:
+                pass
+            else:
+                loop.call_soon(ref, None)
+            stack.extend(
+                child
+                for child in reversed(old_node.children)
+                if isinstance(child, HTMLNode) and child.ref_count
+            )
 
     for new_index, new_node in enumerate(new_nodes):
-        if not isinstance(new_node, tuple):
+        if not isinstance(new_node, HTMLNode):
             continue
 
         try:
@@ -426,7 +859,7 @@ def html_refs(old_node, new_node, queue, subscriptions, path=(), root=None):
 
             if old_node is None:
                 try:
-                    ref = new_node[1]['ref']
+                    ref = new_node.props['ref']
                 except KeyError:
                     pass
                 else:
@@ -434,9 +867,6 @@ def html_refs(old_node, new_node, queue, subscriptions, path=(), root=None):
                     node = Node.from_path(root, new_path, queue, subscriptions)
                     loop.call_soon(ref, node)
 
-            if isinstance(old_node, tuple):
-                old_node = (None, {}, *old_node[2:])
-            new_node = (None, {}, *new_node[2:])
             html_refs(
                 old_node, new_node,
                 queue, subscriptions, new_path, root,
@@ -0,0 +1,144 @@
+from .html import HTMLNode
+
+
+NODE_ACTIONS = {'set', 'unset', 'focus'}
+CHILD_ACTIONS = {'insert', 'replace', 'move'}
+
+
+class Tree:
+
+    __slots__ = ['id', 'parent', 'index', 'node', 'children']
+
+    def __init__(self, id, parent, index):
+        self.id = id
+        self.parent = parent
+        self.index = index
+        self.node = None
+        self.children = []
+
+
+class NodeIds:
+
+    # mirror of the dom on the client where every element has a numeric id,
+    # both sides assign these ids in document order when creating elements so
+    # they stay in sync without the ids having to be sent along, every tree
+    # also refers to its node in the current result so ids from the client
+    # resolve to nodes without searching
+    def __init__(self, result):
+        self._next_id = 0
+        self._trees = {}
+        self._root = self._from_result(result, None, None)
+
+    def _create(self, parent, index):
+        tree = Tree(self._next_id, parent, index)
+        self._next_id += 1
+        self._trees[tree.id] = tree
+        return tree
+
+    def _from_result(self, node, parent, index):
+        if not isinstance(node, HTMLNode):
+            return None
+        tree = self._create(parent, index)
+        tree.node = node
+        tree.children.extend(
+            self._from_result(child, tree, child_index)
+            for child_index, child in enumerate(node.flat)
+        )
+        return tree
+
+    def _from_data(self, data, parent):
+        # the node and index are filled in by update
+        if not isinstance(data, (list, tuple)):
+            return None
+        tree = self._create(parent, None)
+        tree.children.extend(
+            self._from_data(child, tree)
+            for child in data[2:]
+        )
+        return tree
+
+    def _remove(self, tree):
+        stack = [tree]
+        while stack:
+            tree = stack.pop()
+            if tree is not None:
+                del self._trees[tree.id]
+                stack.extend(tree.children)
+
+    def _get(self, path):
+        tree = self._root
+        for index in path:
+            tree = tree.children[index]
+        return tree
+
+    def translate(self, actions):
+        for action in actions:
+            action_type, *args = action
+
+            if action_type in NODE_ACTIONS:
+                if action_type == 'set':
+                    *path, key, value = args
+                    args = (key, value)
+                elif action_type == 'unset':
+                    *path, key = args
+                    args = (key,)
+                else:
+                    path = args
+                    args = ()
+                yield (action_type, self._get(path).id, *args)
+
+            elif action_type == 'remove':
+                *path, index = args
+                parent = self._get(path)
+                self._remove(parent.children.pop(index))
+                yield (action_type, parent.id, index)
+
+            elif action_type in CHILD_ACTIONS:
+                *path, index, arg = args
+                parent = self._get(path)
+                children = parent.children
+
+                if action_type == 'insert':
+                    children.insert(index, self._from_data(arg, parent))
+                elif action_type == 'replace':
+                    self._remove(children[index])
+                    children[index] = self._from_data(arg, parent)
+                else:
+                    children.insert(arg, children.pop(index))
+
+                yield (action_type, parent.id, index, arg)
+
+            else:
+                yield action
+
+    def update(self, result):
+        # points the trees at the nodes of the result the translated actions
+        # lead to, subtrees that were reused from the previous result still
+        # point at the right nodes so they are skipped
+        stack = [(self._root, result)]
+        while stack:
+            tree, node = stack.pop()
+            if tree.node is node:
+                continue
+            tree.node = node
+            for index, (child_tree, child) in enumerate(
+                zip(tree.children, node.flat)
+            ):
+                if child_tree is not None:
+                    child_tree.index = index
+                    stack.append((child_tree, child))
+
+    def __contains__(self, id):
+        return id in self._trees
+
+    def get(self, id):
+        # the node with this id and its parents as pairs of the parent and the
+        # index in that parent, like the parents of vivi.node.Node
+        tree = self._trees[id]
+        node = tree.node
+        parents = []
+        while tree.parent is not None:
+            parents.append((tree.parent.node, tree.index))
+            tree = tree.parent
+        parents.reverse()
+        return parents, node
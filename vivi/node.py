@@ -1,7 +1,9 @@
 from collections.abc import Mapping
 import weakref
 
-from .html import SafeText, html_flatten, html_get, html_flatten_with_mapping
+from .html import (
+    SafeText, HTMLNode, html_get, html_flatten_with_mapping,
+)
 from .filter import parse_filter
 
 
@@ -17,6 +19,15 @@ class Subscription:
         return self.ref()._on_result(*args, **kwargs)
 
 
+def remap_nodes(subscriptions, result):
+    # all nodes are remapped in one pass, nodes often share parents so the
+    # mappings of changed parents are computed once and shared between them,
+    # the previous node is kept in the cache so its id stays unique
+    mappings = {}
+    for subscription in list(subscriptions):
+        subscription(result, mappings)
+
+
 class Node(Mapping):
 
     def __init__(self, parents, node, queue=None, subscriptions=None):
@@ -35,27 +46,38 @@ class Node(Mapping):
         self._subscription = Subscription(self)
         subscriptions.add(self._subscription)
 
-    def _on_result(self, result):
+    def _on_result(self, result, mappings=None):
+        if mappings is None:
+            mappings = {}
+
         parents = []
         node = result
 
         old_parents = iter(self._parents)
         for prev_node, prev_index in old_parents:
+            # the rest of the path was reused, so the node itself is as well
             if node is prev_node:
                 parents.append((prev_node, prev_index))
                 parents.extend(old_parents)
-                break
+                self._parents = tuple(parents)
+                return
 
-            _, nodes, index_mapping = (
-                html_flatten_with_mapping(prev_node, node)
-            )
+            key = (id(prev_node), id(node))
             try:
-                index = next(
-                    index
-                    for index, prev_index_ in index_mapping.items()
-                    if prev_index_ == prev_index
+                _, nodes, prev_indexes = mappings[key]
+            except KeyError:
+                _, nodes, index_mapping = (
+                    html_flatten_with_mapping(prev_node, node)
                 )
-            except StopIteration:
+                prev_indexes = {
+                    prev_index_: index
+                    for index, prev_index_ in index_mapping.items()
+                }
+                mappings[key] = (prev_node, nodes, prev_indexes)
+
+            try:
+                index = prev_indexes[prev_index]
+            except KeyError:
                 self._parents = tuple(old_parents)
                 self._subscriptions.remove(self._subscription)
                 self._subscriptions = None
@@ -94,8 +116,8 @@ class Node(Mapping):
     def type(self):
         if isinstance(self._node, (str, SafeText)):
             return 'text'
-        elif isinstance(self._node, tuple):
-            if self._node[0] is None:
+        elif isinstance(self._node, HTMLNode):
+            if self._node.tag is None:
                 return 'document'
             else:
                 return 'element'
@@ -106,29 +128,27 @@ class Node(Mapping):
     def tag(self):
         if self.type != 'element':
             raise ValueError('node is not an element')
-        return self._node[0]
+        return self._node.tag
 
     def __getitem__(self, key):
         if self.type != 'element':
             raise ValueError('node is not an element')
-        return self._node[1][key]
+        return self._node.props[key]
 
     def __iter__(self, key):
         if self.type != 'element':
             raise ValueError('node is not an element')
-        return iter(self._node[1])
+        return iter(self._node.props)
 
     def __len__(self, key):
         if self.type != 'element':
             raise ValueError('node is not an element')
-        return len(self._node[1])
+        return len(self._node.props)
 
     def children(self, *, deep=False):
         if self.type not in ('element', 'document'):
             raise ValueError('node is not an element')
-        for index, node in enumerate(html_flatten(
-            (None, {}, {}, *self._node[3:])
-        )):
+        for index, node in enumerate(self._node.flat):
             node = Node(
                 (*self._parents, (self._node, index)), node,
                 self._queue, self._subscriptions,
@@ -7,17 +7,41 @@ from starlette.convertors import CONVERTOR_TYPES
 from ..html import SafeText
 from ..node import Node
 from ..filter import parse_filter
-from ..events import CallbackWrapper
+from ..events import CallbackWrapper, ClientActions
 
 
 UUID_CONVERTOR = CONVERTOR_TYPES['uuid']
 NO_VALUE = object()
 FILE_RE = re.compile(fr'/file/({UUID_CONVERTOR.regex})')
+FIELD_TAGS = {'input', 'select', 'textarea'}
+NO_FIELD_TYPES = {'file', 'submit', 'button', 'reset', 'image'}
+CHECKED_TYPES = {'checkbox', 'radio'}
 
 
-def dispatch(target, event_type, details):
+def dispatch(target, event_type, details, input_values=None):
     loop = asyncio.get_running_loop()
 
+    # like in the browser inputs keep the value that was entered so it can be
+    # submitted with their form, for checkboxes and radio buttons this is
+    # whether they were checked
+    if (
+        input_values is not None and
+        event_type in ('input', 'change') and
+        'value' in details and
+        target.type == 'element' and
+        not is_checkable(target)
+    ):
+        input_values[id(target)] = (target, details['value'])
+
+    if (
+        event_type == 'submit' and
+        target.type == 'element' and
+        target.tag == 'form'
+    ):
+        details['values'] = form_values(
+            target, {} if input_values is None else input_values,
+        )
+
     if (
         target.type == 'element' and
         target.tag == 'input' and
@@ -28,6 +52,7 @@ def dispatch(target, event_type, details):
         else:
             details['file'] = details.pop('value')
 
+    prevented = False
     current_target = target
     while current_target is not None:
         try:
@@ -44,6 +69,15 @@ def dispatch(target, event_type, details):
             args[callback.key] = callback.value
             callback = callback.callback
 
+        # client actions do not affect the server
+        if isinstance(callback, ClientActions):
+            callback = None
+
+        if 'keys' in args and details.get('key') not in args['keys']:
+            callback = None
+            args['prevent_default'] = False
+            args['stop_propagation'] = False
+
         event = SimpleNamespace(
             type=event_type,
             target=target,
@@ -53,15 +87,28 @@ def dispatch(target, event_type, details):
 
         if callback is not None:
             loop.call_soon(callback, event)
-        if not args['prevent_default']:
-            loop.call_soon(default_callback, event)
+        if args['prevent_default']:
+            prevented = True
+        else:
+            loop.call_soon(default_callback, event, input_values)
         if args['stop_propagation']:
             break
 
         current_target = current_target.parent
 
+    # the browser checks the input before the callbacks run and reverts this
+    # when the default is prevented, the callbacks run after this either way
+    if (
+        input_values is not None and
+        event_type == 'click' and
+        not prevented and
+        is_checkable(target) and
+        not target.get('disabled', False)
+    ):
+        check(target, input_values)
+
 
-def default_callback(event):
+def default_callback(event, input_values=None):
     if (
         event.type == 'click' and
         event.current_target.type == 'element' and
@@ -71,11 +118,93 @@ def default_callback(event):
         node = event.current_target.parent
         while node is not None:
             if node.type == 'element' and node.tag == 'form':
-                dispatch(node, 'submit', {})
+                dispatch(node, 'submit', {}, input_values)
                 break
             node = node.parent
 
 
+def is_checkable(node):
+    return (
+        node.type == 'element' and
+        node.tag == 'input' and
+        node.get('type') in CHECKED_TYPES
+    )
+
+
+def entered_values(input_values):
+    entered = {}
+    for key, (node, value) in list(input_values.items()):
+        # the node is no longer subscribed once it is removed
+        if node._subscription is None:
+            del input_values[key]
+        else:
+            entered[id(node._node)] = value
+    return entered
+
+
+def check(target, input_values):
+    if target['type'] == 'checkbox':
+        checked = entered_values(input_values).get(
+            id(target._node), target.get('checked', False),
+        )
+        input_values[id(target)] = (target, not checked)
+        return
+
+    input_values[id(target)] = (target, True)
+
+    # the other radio buttons with the same name in the form are unchecked
+    name = target.get('name')
+    if name is None:
+        return
+    root = target.parent
+    while root.parent is not None and not (
+        root.type == 'element' and root.tag == 'form'
+    ):
+        root = root.parent
+    for node in root.children(deep=True):
+        if (
+            node._node is not target._node and
+            is_checkable(node) and
+            node['type'] == 'radio' and
+            node.get('name') == name
+        ):
+            node._subscribe(target._queue, target._subscriptions)
+            input_values[id(node)] = (node, False)
+
+
+def form_values(form, input_values):
+    entered = entered_values(input_values)
+
+    values = {}
+    for node in form.children(deep=True):
+        if (
+            node.type != 'element' or
+            node.tag not in FIELD_TAGS or
+            node.get('name') is None or
+            node.get('disabled', False)
+        ):
+            continue
+
+        if node.tag == 'input' and node.get('type') in NO_FIELD_TYPES:
+            continue
+        elif is_checkable(node):
+            if not entered.get(id(node._node), node.get('checked', False)):
+                continue
+            value = node.get('value', 'on')
+        else:
+            value = entered.get(id(node._node), node.get('value', ''))
+
+        name = node['name']
+        if name not in values:
+            values[name] = value
+        elif isinstance(values[name], list):
+            values[name].append(value)
+        else:
+            values[name] = [values[name], value]
+
+    return values
+
+
 class Assertion:
 
     def __init__(self, session, actions):
@@ -318,6 +447,10 @@ class Assertion:
                 _, value = action
                 self._event(nodes, 'input', value=value)
 
+            elif action[0] == 'keydown':
+                _, key = action
+                self._event(nodes, 'keydown', key=key)
+
             else:
                 raise ValueError(f'unknown action: {action[0]}')
 
@@ -334,7 +467,7 @@ class Assertion:
             ) from None
 
         target._subscribe(self._session._queue, self._session._subscriptions)
-        dispatch(target, event_type, details)
+        dispatch(target, event_type, details, self._session._input_values)
 
     async def _aget(self):
         await asyncio.wait(
@@ -512,6 +645,9 @@ class Assertion:
     def click(self):
         return Assertion(self._session, (*self._actions, ('click',)))
 
+    def keydown(self, key):
+        return Assertion(self._session, (*self._actions, ('keydown', key)))
+
     def input(self, value=NO_VALUE, **details):
         if value is NO_VALUE:
             value = SimpleNamespace(**details)
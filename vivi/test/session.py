@@ -4,6 +4,7 @@ from contextlib import AsyncExitStack
 from ..app import Vivi, mount
 from ..paths import Paths
 from ..html import html_refs
+from ..node import remap_nodes
 from .assertion import Assertion
 
 
@@ -36,6 +37,7 @@ class TestSession(Assertion):
         self._elem = elem
         self._shared = shared
         self._subscriptions = set()
+        self._input_values = {}
 
     def start(self, loop=None):
         if loop is None:
@@ -130,10 +132,19 @@ class TestSession(Assertion):
                     changes.append(self._queue.get_nowait())
 
                 paths = Paths()
+                transition = False
+                transition_ends = []
                 for change in changes:
                     if change[0] == 'path':
                         _, path = change
                         paths[path] = None
+                    elif change[0] == 'transition_path':
+                        _, path = change
+                        paths[path] = None
+                        transition = True
+                    elif change[0] == 'transition_end':
+                        _, callback = change
+                        transition_ends.append(callback)
                     elif change[0] == 'prev_url':
                         self._next.append(self._url)
                         self._url = self._prev.pop()
@@ -162,10 +173,13 @@ class TestSession(Assertion):
                         raise ValueError(f'unknown change: {change[0]}')
 
                 old_result = self._result
-                self._result = rerender(self._url, paths)
+                self._result = rerender(
+                    self._url, paths, transition=transition,
+                )
+                for callback in transition_ends:
+                    callback()
 
-                for callback in list(self._subscriptions):
-                    callback(self._result)
+                remap_nodes(self._subscriptions, self._result)
                 html_refs(
                     old_result, self._result,
                     self._queue, self._subscriptions,